@@ -0,0 +1,287 @@
+"""
+Parallel, resumable bulk downloader of url lists (e.g. acl_data/data/2021.txt).
+
+Replacement of wget -i: the files are fetched concurrently with a cap on the
+connections open at once per host, interrupted files are resumed from their .part file with
+a Range request (guarded by If-Range), and files that are already complete
+(same size and ETag as on the server) are skipped. Large files are split into
+byte ranges fetched over parallel connections (see range_download), the other
+ones are streamed over a single connection. The results are appended to
+a manifest (one json line per url, the last line of a url wins), which is also
+what a restarted run resumes from.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote, urlparse
+from tqdm import tqdm
+import http_client
+import range_download
+from retry import retry_call
+from verify import IntegrityError
+
+# Chunk size of the streamed downloads
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadManifest:
+    def __init__(self, path):
+        """
+        @param path: The path of the manifest file (json lines), existing records are loaded from it.
+        """
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Partially written line of an interrupted run
+                        continue
+                    self.records[record["url"]] = record
+
+        self._file = open(path, "a")
+
+    def get(self, url):
+        """
+        @return: The last record of a url (an empty dictionary if there is none).
+        """
+        with self._lock:
+            return self.records.get(url, {})
+
+    def record(self, url, status, **fields):
+        """
+        Append a record (thread-safe).
+        @param url: The url.
+        @param status: One of partial, complete, skipped or failed.
+        @param fields: Other fields of the record, e.g. path, size, etag.
+        """
+        record = {"url": url, "status": status, **fields}
+        with self._lock:
+            self.records[url] = record
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class HostLimiter:
+    def __init__(self, per_host):
+        """
+        @param per_host: The maximum number of concurrent connections per host.
+        """
+        self.per_host = per_host
+        self._in_use = Counter()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def __call__(self, url, connections=1):
+        """
+        Hold connections to the host of url, all at once so that two large files cannot each wait
+        for the connections held by the other (usage: with limiter(url, n) as n: ...).
+        @param connections: The number of connections, capped at per_host.
+        @return: The number of connections held.
+        """
+        host = urlparse(url).hostname
+        connections = min(connections, self.per_host)
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_use[host] + connections <= self.per_host)
+            self._in_use[host] += connections
+        try:
+            yield connections
+        finally:
+            with self._cond:
+                self._in_use[host] -= connections
+                self._cond.notify_all()
+
+
+def read_url_lists(paths):
+    """
+    Read url lists (one url per line, empty lines and # comments are ignored).
+    @return: The urls without duplicates, in order.
+    """
+    urls = []
+    for path in paths:
+        with open(path, "r") as f:
+            urls.extend(line.strip() for line in f
+                        if line.strip() and not line.startswith("#"))
+    return list(dict.fromkeys(urls))
+
+
+def local_path(url, output_dir):
+    """
+    @return: The path a url is saved to (its file name in output_dir, like wget -P).
+    """
+    return os.path.join(output_dir, unquote(os.path.basename(urlparse(url).path)))
+
+
+def _validators(res):
+    return {"etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified")}
+
+
+def is_complete(url, path, manifest):
+    """
+    Check whether a downloaded file is complete: it has the size announced by the server, and the
+    same ETag as when it was downloaded (if known). If the server answers neither HEAD nor range
+    requests, the file is complete if it is recorded as such with its current size.
+    """
+    if not os.path.exists(path):
+        return False
+    record = manifest.get(url)
+    res = http_client.head(url)
+    if res.ok:
+        size, validator = res.headers.get("Content-Length"), res.headers.get("ETag")
+    else:
+        # Some servers reject HEAD requests (405, 403), ask for the first byte instead
+        size, validator = range_download.probe_range(url)
+        if size is None:
+            # Nothing to compare with, trust a complete record of the same size
+            return record.get("status") == "complete" and record.get("size") == os.path.getsize(path)
+    if size is None or int(size) != os.path.getsize(path):
+        return False
+    # probe_range gives the ETag of the files that have one (a recorded etag implies one)
+    return record.get("etag") is None or validator in (None, record["etag"])
+
+
+def _download(url, path, manifest):
+    part_path = path + ".part"
+    previous = manifest.get(url)
+    validator = previous.get("etag") or previous.get("last_modified")
+
+    # Only resume a partial file whose validator is known, so that a changed file is restarted
+    # (whether the previous attempt is still partial or failed since)
+    offset = 0
+    headers = {}
+    if validator and os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+
+    with http_client.get(url, headers=headers, stream=True) as res:
+        if res.status_code == 416:
+            # The partial file is not a prefix of the current file
+            os.remove(part_path)
+            manifest.record(url, "failed", path=path, error="range not satisfiable")
+            raise IntegrityError(f"Range not satisfiable for {url}, restarting")
+        res.raise_for_status()
+        if res.status_code != 206:
+            offset = 0
+        expected = res.headers.get("Content-Length")
+        expected = offset + int(expected) if expected is not None else None
+        manifest.record(url, "partial", path=path, **_validators(res))
+
+        with open(part_path, "ab" if offset else "wb") as f:
+            for chunk in res.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+            size = f.tell()
+
+        if expected is not None and size != expected:
+            raise IntegrityError(f"Truncated download of {url}: {size}/{expected} bytes")
+        os.replace(part_path, path)
+        manifest.record(url, "complete", path=path, size=size, **_validators(res))
+
+    return "resumed" if offset else "downloaded"
+
+
+def download_file(url, output_dir, manifest, limiter, connections=1):
+    """
+    Download a url, resuming its partial file and skipping it if it is complete already.
+    @param url: The url.
+    @param output_dir: The directory of the downloaded files.
+    @param manifest: The DownloadManifest.
+    @param limiter: The HostLimiter.
+    @param connections: The number of parallel range requests of large files, default is 1.
+    @return: The outcome: downloaded, resumed, skipped or failed.
+    """
+    path = local_path(url, output_dir)
+    try:
+        with limiter(url):
+            if retry_call(is_complete, url, path, manifest):
+                if manifest.get(url).get("status") != "complete":
+                    manifest.record(url, "complete", path=path, size=os.path.getsize(path))
+                return "skipped"
+        if connections > 1:
+            # Every range request counts against the cap of the host
+            with limiter(url, connections) as held:
+                size = range_download.download(url, path, connections=held) if held > 1 else None
+            if size is not None:
+                manifest.record(url, "complete", path=path, size=size)
+                return "downloaded"
+        with limiter(url):
+            return retry_call(_download, url, path, manifest)
+    except Exception as e:
+        # The validators of the partial file are kept for the next run to resume it
+        previous = manifest.get(url)
+        manifest.record(url, "failed", path=path, error=str(e), etag=previous.get("etag"),
+                        last_modified=previous.get("last_modified"))
+        return "failed"
+
+
+def download_all(urls, output_dir, mthread=16, per_host=4, manifest_path=None, connections=4):
+    """
+    Download urls concurrently.
+    @param urls: The list of urls.
+    @param output_dir: The directory of the downloaded files, created if it does not exist.
+    @param mthread: The number of concurrent downloads, default is 16.
+    @param per_host: The maximum number of concurrent connections to a host, default is 4.
+    @param manifest_path: The path of the manifest, default is output_dir/manifest.jsonl.
+    @param connections: The number of parallel range requests per large file (capped at per_host),
+    default is 4.
+    @return: A Counter of the outcomes.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = DownloadManifest(manifest_path or os.path.join(output_dir, "manifest.jsonl"))
+    limiter = HostLimiter(per_host)
+    http_client.get_session(pool_size=mthread * connections)
+
+    outcomes = Counter()
+    try:
+        with ThreadPoolExecutor(max_workers=mthread) as pool:
+            futures = [pool.submit(download_file, url, output_dir, manifest, limiter, connections)
+                       for url in urls]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                outcomes[future.result()] += 1
+    finally:
+        manifest.close()
+
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Download the files of url lists (e.g. acl_data/data/2021.txt).')
+    parser.add_argument('url_lists', type=str, nargs="+",
+                        help='Files with one url per line.')
+    parser.add_argument('-P', '--output-dir', type=str, default=".",
+                        help='Directory of the downloaded files, default is the current directory.')
+    parser.add_argument('--mthread', type=int, default=16,
+                        help='Number of concurrent downloads, default is 16.')
+    parser.add_argument('--per-host', type=int, default=4,
+                        help='Maximum number of concurrent connections to a host, default is 4.')
+    parser.add_argument('--connections', type=int, default=4,
+                        help='Parallel range requests per large file (1 to disable, at most --per-host), '
+                             'default is 4.')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Path of the manifest, default is manifest.jsonl in the output directory.')
+    args = parser.parse_args()
+
+    urls = read_url_lists(args.url_lists)
+    outcomes = download_all(urls, args.output_dir, mthread=args.mthread,
+                            per_host=args.per_host, manifest_path=args.manifest,
+                            connections=args.connections)
+    print(", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items())))
+    if outcomes["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+asyncio download engine for .ts segments.
+
+Drives a large number of concurrent segment fetches on a single event loop
+(bounded by a semaphore) instead of one thread per request. File writes are
+handed to the default executor so that the loop never blocks on the disk.
+"""
+
+import asyncio
+import os
+import time
+import aiohttp
+from tqdm import tqdm
+from config import USER_AGENT
+from http_client import CONNECT_TIMEOUT, READ_TIMEOUT, DNS_TTL
+from rate_control import THROTTLE_STATUS
+from retry import retry_async, is_retryable
+from verify import check_segment
+
+
+def _is_retryable(exc):
+    return isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)) \
+        or is_retryable(exc)
+
+
+def _write_file(fname, data):
+    with open(fname, "wb") as f:
+        f.write(data)
+
+
+async def _download_segment(session, semaphore, seg, tmp_path, index, writer, manifest, controller, pbar,
+                            name=None):
+    """
+    Download a single video segment (.ts) to the directory specified by tmp_path,
+    or hand it to the writer if specified.
+    """
+    limiter = controller.limiter(seg.absolute_uri) if controller else None
+
+    async def fetch():
+        if limiter:
+            await limiter.acquire_async()
+        start = time.monotonic()
+        try:
+            async with session.get(seg.absolute_uri) as res:
+                data = await res.read()
+        except BaseException as e:
+            if limiter:
+                # A cancelled request says nothing about the server
+                limiter.release(error=isinstance(e, Exception))
+            raise
+        if limiter:
+            limiter.release(
+                time.monotonic() - start, len(data),
+                error=res.status >= 500 and res.status not in THROTTLE_STATUS,
+                throttled=res.status in THROTTLE_STATUS,
+            )
+        res.raise_for_status()
+        check_segment(data, res.headers.get("Content-Length")
+                      if "Content-Encoding" not in res.headers else None, seg.absolute_uri)
+        return data
+
+    # Transient failures (including truncated bodies) are retried with backoff
+    async with semaphore:
+        data = await retry_async(fetch, retryable=_is_retryable)
+
+    bucket = controller.bucket(seg.absolute_uri) if controller else None
+    if bucket:
+        await asyncio.sleep(bucket.reserve(len(data)))
+
+    loop = asyncio.get_running_loop()
+    if writer:
+        await loop.run_in_executor(None, writer.write, index, data)
+    else:
+        name = name or seg.uri
+        await loop.run_in_executor(None, _write_file, os.path.join(tmp_path, name), data)
+        if manifest:
+            manifest.record(name, len(data))
+    pbar.update(1)
+
+    return len(data)
+
+
+async def _download_segments(segments, tmp_path, concurrency, indices, writer, manifest, controller,
+                             names):
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(
+        limit=concurrency, limit_per_host=concurrency, ttl_dns_cache=DNS_TTL)
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout, headers={"User-Agent": USER_AGENT}
+    ) as session:
+        with tqdm(total=len(segments)) as pbar:
+            sizes = await asyncio.gather(
+                *[_download_segment(
+                    session, semaphore, seg, tmp_path, i, writer, manifest, controller, pbar, name)
+                  for i, seg, name in zip(indices, segments, names)]
+            )
+
+    return sum(sizes)
+
+
+def download_segments(segments, tmp_path, concurrency=200, indices=None, writer=None, manifest=None,
+                      controller=None, names=None):
+    """
+    Download all segments concurrently on one event loop.
+    @param segments: The m3u8 segments of a chunklist, in playlist order.
+    @param tmp_path: The directory in which the .ts files are stored.
+    @param concurrency: The maximum number of in-flight requests, default is 200.
+    @param indices: The positions of the segments in their chunklist, default is 0, 1, ...
+    @param writer: If specified, the segments are handed to this OrderedSegmentWriter
+    instead of being stored as tmp files.
+    @param manifest: If specified, the stored .ts files are recorded in this SegmentManifest.
+    @param controller: If specified, the requests are sent under the limits of this RateController.
+    @param names: The names of the tmp files and manifest records of the segments (see
+    segment_manifest.segment_name), default is their uris.
+    @return: The total number of bytes downloaded.
+    """
+    indices = range(len(segments)) if indices is None else indices
+    names = [None] * len(segments) if names is None else names
+    return asyncio.run(_download_segments(
+        segments, tmp_path, concurrency, indices, writer, manifest, controller, names))
@@ -0,0 +1,351 @@
+"""
+Bounded pool of warm headless Chrome drivers shared by the crawler functions.
+
+Starting Chrome (and resolving the chromedriver binary) dominates the cost of
+loading a single page, so workers lease an already running driver from the
+pool instead, and give it back afterwards (with its performance log drained).
+A driver is recycled (quit and replaced by a fresh one on the next lease) after
+serving max_pages pages.
+
+The pool also supervises the browser processes: a driver is always torn down
+after a failure, browsers above a memory cap are replaced, and browsers that
+hang in a lease are killed by a watchdog (memory accounting and killing the
+whole process tree require psutil).
+
+Each lease can apply a resource-blocking profile (BLOCK_PROFILES), so that the
+browser does not download images, fonts, analytics or video media that the
+crawler never looks at.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from webdriver_manager.chrome import ChromeDriverManager
+from config import USER_AGENT
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Url patterns (CDP Network.setBlockedURLs wildcards) blocked by each profile
+_STATIC_RESOURCES = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.webp", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+]
+BLOCK_PROFILES = {
+    "none": [],
+    # Pages that are only parsed (scripts such as openagenda still run)
+    "page": _STATIC_RESOURCES,
+    # Video pages: the player may request playlist.m3u8 but not the chunklists and media
+    "player": _STATIC_RESOURCES + [
+        "*chunklist*.m3u8", "*.ts", "*.m4s", "*.aac", "*.vtt",
+    ],
+}
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def get_driver_path():
+    """
+    Resolve (download if needed) the chromedriver binary once per process.
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            _driver_path = ChromeDriverManager().install()
+    return _driver_path
+
+
+def create_driver():
+    """
+    Start a headless Chrome webdriver with performance logging enabled.
+    """
+    options = Options()
+
+    # Chrome will start in Headless mode
+    options.add_argument("headless")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--allow-running-insecure-content")
+
+    # Crucial for the website to load videos
+    options.add_argument(f"user-agent={USER_AGENT}")
+
+    # Do not wait for the subresources (e.g. the video player) when loading a page, elements
+    # rendered by scripts must be waited for (see page_fetch.fetch_soup)
+    options.page_load_strategy = "eager"
+
+    # Enable performance logging to record network requests/responses
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    return webdriver.Chrome(
+        service=Service(get_driver_path()),
+        options=options,
+    )
+
+
+class DriverPool:
+    def __init__(self, size=10, max_pages=50, max_rss=1024, lease_timeout=120, page_timeout=60):
+        """
+        @param size: The maximum number of live drivers, default is 10.
+        @param max_pages: The number of leases after which a driver is recycled, default is 50.
+        @param max_rss: The memory cap (in MB) of a browser and its child processes, checked after
+        every lease (requires psutil), default is 1024.
+        @param lease_timeout: Seconds after which a leased browser is considered hung and killed,
+        default is 120.
+        @param page_timeout: The page load and script timeout of the browsers in seconds, default is 60.
+        """
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.lease_timeout = lease_timeout
+        self.page_timeout = page_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._pages = {}  # All live drivers -> number of served leases
+        self._leased = {}  # Leased drivers -> lease start time
+        self._profiles = {}  # Live drivers -> applied blocking profile
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Kill the browsers that stop responding while leased
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+
+    @contextmanager
+    def lease(self, block="none"):
+        """
+        Lease a driver, blocking while all drivers are in use. The driver is torn down if the
+        block raises, if it exceeds the memory cap or if it has served max_pages leases.
+        Usage: with pool.lease() as driver: driver.get(url)
+        @param block: The resource-blocking profile (a key of BLOCK_PROFILES), default is none.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = create_driver()
+                driver.set_page_load_timeout(self.page_timeout)
+                driver.set_script_timeout(self.page_timeout)
+                with self._lock:
+                    self._pages[driver] = 0
+
+            with self._lock:
+                self._leased[driver] = time.monotonic()
+            try:
+                self._block(driver, block)
+                yield driver
+            except BaseException:
+                # The state of the browser is unknown after a failure
+                self._retire(driver)
+                raise
+            finally:
+                with self._lock:
+                    self._leased.pop(driver, None)
+
+            with self._lock:
+                self._pages[driver] += 1
+                worn_out = self._pages[driver] >= self.max_pages
+            if worn_out or self._rss(driver) > self.max_rss or not self._drain_log(driver):
+                self._retire(driver)
+            else:
+                self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _drain_log(driver):
+        """
+        Discard the performance log of a returned driver, which is only read (and emptied) by
+        wait_for_request and would otherwise keep growing over the leases of the driver.
+        @return: False if the browser does not respond.
+        """
+        try:
+            driver.get_log("performance")
+        except Exception:
+            return False
+        return True
+
+    def _block(self, driver, profile):
+        """
+        Apply a resource-blocking profile to a driver (no-op if already applied).
+        """
+        if self._profiles.get(driver, "none") == profile:
+            return
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd(
+            "Network.setBlockedURLs", {"urls": BLOCK_PROFILES[profile]})
+        self._profiles[driver] = profile
+
+    @staticmethod
+    def _processes(driver):
+        """
+        @return: The chromedriver process of a driver and its children (the browser processes).
+        """
+        if psutil is None:
+            return []
+        try:
+            process = psutil.Process(driver.service.process.pid)
+            return [process] + process.children(recursive=True)
+        except (psutil.Error, AttributeError):
+            return []
+
+    def _rss(self, driver):
+        """
+        @return: The resident memory of a browser in MB (0 if unknown).
+        """
+        rss = 0
+        for process in self._processes(driver):
+            try:
+                rss += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss / 1024 / 1024
+
+    def _retire(self, driver):
+        with self._lock:
+            if driver not in self._pages:
+                return
+            self._pages.pop(driver)
+            self._profiles.pop(driver, None)
+        processes = self._processes(driver)
+
+        # quit() hangs on an unresponsive browser, in which case its processes are killed
+        quitter = threading.Thread(target=self._quit, args=(driver,), daemon=True)
+        quitter.start()
+        quitter.join(10)
+        self._kill(driver, processes)
+
+    def _kill(self, driver, processes=None):
+        """
+        Kill the processes of a driver (only chromedriver itself without psutil).
+        """
+        processes = self._processes(driver) if processes is None else processes
+        if not processes:
+            try:
+                driver.service.process.kill()
+            except Exception:
+                pass
+        for process in processes:
+            try:
+                process.kill()
+            except psutil.Error:
+                pass
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _watch(self):
+        last_report = time.monotonic()
+        while not self._closed.wait(5):
+            now = time.monotonic()
+            if self._pages and now - last_report > 60:
+                logging.info(self.report())
+                last_report = now
+            with self._lock:
+                hung = [driver for driver, start in self._leased.items()
+                        if now - start > self.lease_timeout]
+            for driver in hung:
+                logging.warning("Killing a browser leased for more than %ss",
+                                self.lease_timeout)
+                # The worker gets an exception from the dead driver and the lease ends
+                self._kill(driver)
+                with self._lock:
+                    self._leased.pop(driver, None)
+
+    def stats(self):
+        """
+        @return: A dictionary with the number of live, leased and idle browsers and their total
+        resident memory in MB.
+        """
+        with self._lock:
+            drivers = list(self._pages)
+            leased = len(self._leased)
+        return {
+            "live": len(drivers),
+            "leased": leased,
+            "idle": self._idle.qsize(),
+            "rss": sum(self._rss(driver) for driver in drivers),
+        }
+
+    def report(self):
+        stats = self.stats()
+        return (f"{stats['live']} browsers ({stats['leased']} leased, {stats['idle']} idle) "
+                f"using {stats['rss']:.0f}MB")
+
+    def close(self):
+        """
+        Tear down all the browsers.
+        """
+        self._closed.set()
+        with self._lock:
+            drivers = list(self._pages)
+        for driver in drivers:
+            self._retire(driver)
+
+
+def wait_for_request(driver, suffix, timeout=20, poll=0.1):
+    """
+    Wait until the browser sends a request to a url ending with suffix. The performance log is
+    polled and each read drains it, so only the few entries logged since the previous poll are
+    kept and parsed (entries not mentioning suffix are not even parsed).
+    @param driver: The driver, with performance logging enabled.
+    @param suffix: The end of the awaited url, e.g. playlist.m3u8.
+    @param timeout: Seconds to wait, default is 20.
+    @param poll: Seconds between reads of the log, default is 0.1.
+    @return: The url of the first matching request.
+    @raise TimeoutException: If no such request is sent in time.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        for log in driver.get_log("performance"):
+            if suffix not in log["message"]:
+                continue
+            params = json.loads(log["message"])["message"]["params"]
+            url = params.get("request", {}).get("url", "")
+            if url.endswith(suffix):
+                return url
+        if time.monotonic() > deadline:
+            raise TimeoutException(f"No request to *{suffix} within {timeout}s")
+        time.sleep(poll)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_driver_pool(size=10):
+    """
+    Get the process-wide driver pool.
+    @param size: The maximum number of live drivers, only used when the pool is created.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DriverPool(size=size)
+            atexit.register(_pool.close)
+    return _pool
+
+
+def lease(block="none"):
+    """
+    Lease a driver from the process-wide pool.
+    @param block: The resource-blocking profile (a key of BLOCK_PROFILES), default is none.
+    """
+    return get_driver_pool().lease(block=block)
@@ -0,0 +1,53 @@
+"""
+HTML parsing layer of the crawler.
+
+Pages are parsed with lxml when it is installed (html.parser otherwise), and
+only the subtrees the extraction functions need are built (SoupStrainer).
+Lookups use precompiled CSS selectors instead of Python predicates that are
+called on every node.
+"""
+
+import re
+import soupsieve as sv
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Subtrees kept when parsing each kind of page
+INDEX_ONLY = SoupStrainer("table", attrs={"border": "1"})
+AGENDA_ONLY = SoupStrainer("div", attrs={"id": "agenda_content"})
+# A multi-valued class is only matched as a whole by a string, e.g. "pdf-links item1"
+PDF_LINKS_ONLY = SoupStrainer("a", attrs={"class": re.compile(r"\bpdf-links\b")})
+LANG_CTRL_ONLY = SoupStrainer("span", attrs={"id": re.compile(r"^ctrl-")})
+
+# Index pages
+INDEX_TABLE = sv.compile("table[border='1']")
+ROW = sv.compile("tr")
+WEBCAST_LINK = sv.compile("a.webcast_link[href]")
+TITLED_IMG = sv.compile("img[title]")
+SCRIPT_CELL = sv.compile("td[valign='top'][align='center']")
+SCRIPT_PAGE_LINK = sv.compile("a[href]:not([href$='.pdf'])")
+
+# Video pages
+AGENDA = sv.compile("div#agenda_content")
+AGENDA_ROW = sv.compile("div.row")
+AGENDA_TIME = sv.compile("span[style='float: left; padding-right: 10px;']")
+AGENDA_LABEL = sv.compile("div[class='col-lg-8 col-6 nopadding']")
+ONCLICK_LINK = sv.compile("a[onclick]")
+
+# Script pages
+PDF_LINK = sv.compile("a.pdf-links.item1")
+
+
+def parse(html, only=None):
+    """
+    Parse a page.
+    @param html: The page source (str or bytes).
+    @param only: Optional SoupStrainer restricting the parse to the matching subtrees.
+    @return: The BeautifulSoup of the page.
+    """
+    return BeautifulSoup(html, PARSER, parse_only=only)
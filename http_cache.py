@@ -0,0 +1,225 @@
+"""
+On-disk HTTP cache of the crawled pages.
+
+Bodies are stored in files keyed by url, with their validators (ETag and
+Last-Modified) in a SQLite index. A cached url is revalidated with a
+conditional request, so an unchanged page costs a 304 without a body. The
+least recently used bodies are evicted when the cache exceeds its size.
+
+Pages rendered by the browser are stored as well, tagged with the validator of
+the static page they were rendered from: as long as the static page is not
+modified, the rendered page is reused without starting a browser. Files
+downloaded to a given path (e.g. script pdfs) only get their validators
+recorded, the file itself being the cached body.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from config import DATA_DIR
+import http_client
+
+# Default size of the cache in bytes
+MAX_SIZE = 1024 * 1024 * 1024
+
+# Chunk size of the downloads to a file
+CHUNK_SIZE = 1024 * 1024
+
+
+class HttpCache:
+    def __init__(self, cache_dir, max_size=MAX_SIZE):
+        """
+        @param cache_dir: The directory of the cache, created if it does not exist.
+        @param max_size: The maximum total size of the cached bodies in bytes, default is 1GB.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "index.db"), timeout=60, isolation_level=None,
+            check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, etag TEXT, "
+            "last_modified TEXT, size INTEGER, accessed_at REAL)")
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _body_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest())
+
+    def _entry(self, key):
+        """
+        @return: The (etag, last_modified) of a cached key, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def _record(self, key, etag, last_modified, size):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, etag, last_modified, size, time.time()))
+            self._size += size - (row[0] if row else 0)
+        if self._size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used bodies until the cache fits in max_size.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries WHERE size > 0 ORDER BY accessed_at").fetchall()
+            for key, size in rows:
+                if self._size <= self.max_size:
+                    break
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                try:
+                    os.remove(self._body_path(key))
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+
+    def _write(self, path, chunks):
+        """
+        Atomically write chunks to path.
+        @return: The number of bytes written.
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return size
+
+    def lookup(self, key, validator=None):
+        """
+        Read a cached body.
+        @param key: The cache key (e.g. the url).
+        @param validator: If given, the body is only returned if it was stored with this validator.
+        @return: The body, or None if it is not cached.
+        """
+        entry = self._entry(key)
+        if entry is None or validator is not None and entry[0] != validator:
+            return None
+        try:
+            with open(self._body_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, key, body, etag=None, last_modified=None):
+        """
+        Cache a body.
+        @param key: The cache key (e.g. the url).
+        @param body: The body (bytes).
+        @param etag: The validator the body is revalidated (or looked up) with.
+        @param last_modified: The Last-Modified date of the body, if any.
+        """
+        size = self._write(self._body_path(key), [body])
+        self._record(key, etag, last_modified, size)
+
+    def _conditional_headers(self, entry, headers=None):
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry[0]:
+                headers["If-None-Match"] = entry[0]
+            if entry[1]:
+                headers["If-Modified-Since"] = entry[1]
+        return headers
+
+    def get(self, url, headers=None, **kwargs):
+        """
+        GET a url through the cache, revalidating the cached body if there is one.
+        @param url: The requested url.
+        @param headers: Additional request headers.
+        @return: A tuple (body, validator), where the validator is the ETag (or the Last-Modified
+        date) of the body, or None if the server sends neither (the body is then not cached).
+        @raise requests.RequestException: If the request fails.
+        """
+        entry = self._entry(url)
+        res = http_client.get(
+            url, headers=self._conditional_headers(entry, headers), **kwargs)
+        if res.status_code == 304 and entry is not None:
+            body = self.lookup(url)
+            if body is not None:
+                return body, entry[0] or entry[1]
+            # The body was evicted in the meantime
+            res = http_client.get(url, headers=headers, **kwargs)
+
+        res.raise_for_status()
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return res.content, None
+        self.store(url, res.content, etag, last_modified)
+        return res.content, etag or last_modified
+
+    def download(self, url, path, headers=None, **kwargs):
+        """
+        Download a url to a file, skipped if the file exists and the url is not modified since, or
+        if the existing file has the size announced by the server (the body is then not read).
+        @param url: The requested url.
+        @param path: The path of the file.
+        @param headers: Additional request headers.
+        @return: Whether the file was (re)downloaded.
+        @raise requests.RequestException: If the request fails.
+        """
+        key = "file:" + path
+        entry = self._entry(key) if os.path.exists(path) else None
+        with http_client.get(url, headers=self._conditional_headers(entry, headers),
+                             stream=True, **kwargs) as res:
+            if res.status_code == 304 and entry is not None:
+                return False
+            res.raise_for_status()
+            etag = res.headers.get("ETag")
+            last_modified = res.headers.get("Last-Modified")
+            size = res.headers.get("Content-Length")
+            downloaded = not (size is not None and os.path.exists(path)
+                              and os.path.getsize(path) == int(size))
+            if downloaded:
+                self._write(path, res.iter_content(CHUNK_SIZE))
+
+        if etag or last_modified:
+            self._record(key, etag, last_modified, 0)
+        return downloaded
+
+    def close(self):
+        self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(cache_dir=None, max_size=MAX_SIZE):
+    """
+    Get the process-wide HTTP cache.
+    @param cache_dir: The directory of the cache, default is DATA_DIR/cache/http. Only used when
+    the cache is created.
+    @param max_size: The maximum size of the cache in bytes, only used when the cache is created.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache(
+                cache_dir or os.path.join(DATA_DIR, "cache", "http"), max_size=max_size)
+    return _cache
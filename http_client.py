@@ -0,0 +1,193 @@
+"""
+Shared HTTP layer used by the crawlers.
+
+All HTTP calls of the project go through a single requests.Session whose
+connection pool is sized to the number of download threads, so that every
+.ts segment (and every script pdf) reuses a warm keep-alive connection instead
+of paying for a new TCP+TLS handshake. Host name lookups of the session are
+cached as well (the resolver of the rest of the process is left alone).
+"""
+
+import socket
+import threading
+import time
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+import m3u8
+from config import USER_AGENT
+
+# Default (connect, read) timeouts in seconds
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+# Number of distinct hosts whose connection pools are kept alive
+POOL_CONNECTIONS = 8
+
+# How long a resolved host name is reused, in seconds
+DNS_TTL = 300
+
+# Maximum number of resolved host names kept
+DNS_CACHE_SIZE = 256
+
+_session = None
+_pool_size = 0
+_session_lock = threading.Lock()
+
+
+class DnsCache:
+    def __init__(self, ttl=DNS_TTL, max_size=DNS_CACHE_SIZE):
+        """
+        Least recently used cache of host name lookups.
+        @param ttl: How long a resolved host name is reused, in seconds, default is DNS_TTL.
+        @param max_size: The maximum number of cached host names, default is DNS_CACHE_SIZE.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (host, port) -> (resolved at, addresses)
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """
+        @return: The addresses of a host, in the order of getaddrinfo.
+        @raise OSError: If the lookup fails.
+        """
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and now - cached[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return cached[1]
+
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._entries[key] = (now, addresses)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return addresses
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_dns_cache = DnsCache()
+
+
+class _CachedDnsMixin:
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = _dns_cache.resolve(host, self.port)
+        except OSError:
+            # Let urllib3 report the failed lookup
+            return super()._new_conn()
+        try:
+            for i, address in enumerate(addresses):
+                # The host name is restored before it is used for TLS and the Host header
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+
+
+class _CachedDnsHTTPConnection(_CachedDnsMixin, HTTPConnection):
+    pass
+
+
+class _CachedDnsHTTPSConnection(_CachedDnsMixin, HTTPSConnection):
+    pass
+
+
+class _CachedDnsHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CachedDnsHTTPConnection
+
+
+class _CachedDnsHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CachedDnsHTTPSConnection
+
+
+class CachedDnsAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections resolve host names through the DNS cache of the module.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CachedDnsHTTPConnectionPool,
+            "https": _CachedDnsHTTPSConnectionPool,
+        }
+
+
+def get_session(pool_size=10):
+    """
+    Get the process-wide HTTP session.
+    @param pool_size: The number of keep-alive connections kept per host, which should be
+    at least the number of threads sharing the session (e.g. mthread). The pool only grows.
+    @return: A requests.Session shared by all threads.
+    """
+    global _session, _pool_size
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update({"User-Agent": USER_AGENT})
+        if pool_size > _pool_size:
+            replaced = _session.adapters.get("https://") if _pool_size else None
+            adapter = CachedDnsAdapter(
+                pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=pool_size,
+                pool_block=False,
+            )
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _pool_size = pool_size
+            if replaced is not None:
+                # The connections in use are closed once their requests are done
+                replaced.close()
+
+    return _session
+
+
+def get(url, timeout=None, **kwargs):
+    """
+    Send a GET request through the shared session.
+    @param url: The requested url.
+    @param timeout: The (connect, read) timeout, default is (CONNECT_TIMEOUT, READ_TIMEOUT).
+    @return: The requests.Response object.
+    """
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return get_session().get(url, timeout=timeout, **kwargs)
+
+
+def head(url, timeout=None, **kwargs):
+    """
+    Send a HEAD request (following redirects) through the shared session.
+    @param url: The requested url.
+    @param timeout: The (connect, read) timeout, default is (CONNECT_TIMEOUT, READ_TIMEOUT).
+    @return: The requests.Response object.
+    """
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    return get_session().head(url, timeout=timeout, allow_redirects=True, **kwargs)
+
+
+def load_m3u8(link, timeout=None):
+    """
+    Load and parse a m3u8 playlist through the shared session (replacement of m3u8.load).
+    @param link: The m3u8 link.
+    @param timeout: The (connect, read) timeout.
+    @return: The parsed m3u8.M3U8 object, with relative uris resolved against the final url.
+    """
+    res = get(link, timeout=timeout)
+    res.raise_for_status()
+    return m3u8.loads(res.text, uri=res.url)
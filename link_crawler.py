@@ -7,36 +7,46 @@ See the link below for reference of some code
 https://www.geeksforgeeks.org/scraping-data-in-network-traffic-using-python/
 """
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 import json
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse, parse_qs, unquote, urlunparse
 import re
 from pathlib import PurePosixPath
 from utils import mkdir_if_not_exist
+import driver_pool
+import page_fetch
+import html_parse
 import os
-import requests
+import http_cache
+import http_client
+from playlist_predictor import PlaylistPredictor
+import sharding
 from tqdm.auto import tqdm
-from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from config import DATA_DIR, USER_AGENT
 import itertools
 import logging
 
 # To fix the certificate error
 import ssl
-import certifi
-from urllib.request import Request, urlopen
+import urllib3
 ssl._create_default_https_context = ssl._create_unverified_context
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
-def download_metadata(data_dir, multilingual=True, session_id="all", mthread=10):
+def download_metadata(data_dir, multilingual=True, session_id="all", mthread=10, incremental=False,
+                      shard=None, claims_dir=None, node_id=None):
+    """
+    Download the metadata (clips.json) of all meetings.
+    @param incremental: Only process the meetings without a clips.json, default is False.
+    @param shard: A tuple (i, n) to only process the meetings of the i-th of n hash shards when
+    several nodes share the work. With claims_dir, the shard is only processed first.
+    @param claims_dir: If specified, the meetings are claimed with lease files in this shared
+    directory (see sharding.LeaseClaims), so that nodes take over the meetings of dead nodes.
+    @param node_id: The name of this node, default is the hostname.
+    """
     # assert session_id in ["all", "1213", "1314", "1415", "1516"]
 
     # Prepare arguments for threading
@@ -44,28 +54,53 @@ def download_metadata(data_dir, multilingual=True, session_id="all", mthread=10)
     session_links = [list(session.values()) for session in sessions.values(
     )] if session_id == "all" else [list(sessions[session_id].values())]
     vp_links = list(itertools.chain.from_iterable(session_links))
+    if incremental:
+        vp_links = [vp_link for vp_link in vp_links if not os.path.exists(
+            clips_path(data_dir, meeting_id(vp_link)))]
+        print(f"{len(vp_links)} meetings without metadata.")
+    claims = None
+    if claims_dir is not None:
+        claims = sharding.LeaseClaims(claims_dir, node_id=node_id)
+        # Start with the own shard, then help with the meetings of the other (possibly dead) nodes
+        vp_links.sort(key=lambda vp_link: not sharding.in_shard(
+            meeting_id(vp_link), shard))
+    else:
+        vp_links = [vp_link for vp_link in vp_links
+                    if sharding.in_shard(meeting_id(vp_link), shard)]
+
+    def crawl(vp_link):
+        if claims is None:
+            return get_speech_metadata(vp_link, multilingual, data_dir)
+        with claims.claimed(meeting_id(vp_link)) as ok:
+            if ok:
+                return get_speech_metadata(vp_link, multilingual, data_dir)
+
+    # One warm browser per thread
+    driver_pool.get_driver_pool(size=mthread)
+    http_cache.get_cache(os.path.join(data_dir, "cache", "http"))
 
     with ThreadPoolExecutor(max_workers=mthread) as pool:
         list(
             tqdm(
-                pool.map(
-                    get_speech_metadata,
-                    vp_links,
-                    [multilingual] * len(vp_links),
-                    [data_dir] * len(vp_links)
-                ),
+                pool.map(crawl, vp_links),
                 total=len(vp_links),
                 position=0,
                 leave=True,
             )
         )
 
+    if claims is not None:
+        claims.close()
+    print(driver_pool.get_driver_pool().report())
 
-def get_speech_metadata(vp_link, multilingual=True, data_dir=None):
+
+def get_speech_metadata(vp_link, multilingual=True, data_dir=None, block="player"):
     """
     @param vp_link: Link to the video page (in any language).
     @param multilingual: Returns chinese/english metadata as well.
     @param data_dir: If specified, the results will be stored as json.
+    @param block: The resource-blocking profile of the browser fallback, default is player (the
+    openagenda scripts still run).
     @return: A dictionary with language ID as key and the corresponding
     metadata list of tuples as value. If multilingual=True, all three
     languages will be returned, otherwise only the vp_link's language's
@@ -75,24 +110,6 @@ def get_speech_metadata(vp_link, multilingual=True, data_dir=None):
     # Language tags in the url
     lang_tags = {"zh-hk": "can", "zh-cn": "man", "en-us": "eng"}
 
-    options = Options()
-
-    # Chrome will start in Headless mode
-    options.add_argument("headless")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--ignore-certificate-errors")
-    options.add_argument("--allow-running-insecure-content")
-
-    # Crucial for the website to load videos
-    user_agent = USER_AGENT
-    options.add_argument(f"user-agent={user_agent}")
-
-    # Start the chrome webdriver with executable path
-    driver = webdriver.Chrome(
-        service=Service(ChromeDriverManager().install()),
-        options=options,
-    )
-
     # The code below first extracts the language id's position
     # from the url, and replace it if multilingual
     parsed_url = urlparse(vp_link)
@@ -130,32 +147,22 @@ def get_speech_metadata(vp_link, multilingual=True, data_dir=None):
     time_regex_2 = re.compile(r"(\")(\d{2}\:\d{2}\:\d{2})(\")")
     for lang, link in vp_links.items():
         results[lang] = []
-        driver.get(link)
-        driver.execute_script(f"openagenda('{mid}')")
-        res = driver.page_source
+        # The agenda is part of the static page, the browser is only a fallback
+        soup = page_fetch.fetch_soup(
+            link, expected="div#agenda_content div.row", script=f"openagenda('{mid}')", wait=10,
+            only=html_parse.AGENDA_ONLY, block=block)
 
-        soup = BeautifulSoup(res, "html.parser")
-
-        agenda = soup.find(
-            lambda tag: tag.name == "div" and tag.has_attr(
-                "id") and tag["id"] == "agenda_content"
-        )
-        rows = agenda.find_all("div", {"class": "row"})
+        agenda = html_parse.AGENDA.select_one(soup)
+        rows = html_parse.AGENDA_ROW.select(agenda)
 
         for row in rows:
-            time_div = row.find(
-                lambda tag: tag.name == "span"
-                and tag.has_attr("style")
-                and tag["style"] == "float: left; padding-right: 10px;"
-            )
+            time_div = html_parse.AGENDA_TIME.select_one(row)
 
             # Get the text of the event/speaker
-            label = row.find("div", {"class": "col-lg-8 col-6 nopadding"})
+            label = html_parse.AGENDA_LABEL.select_one(row)
             # breakpoint()
             if label:
-                onclick_func = time_div.find(
-                    lambda tag: tag.name == "a" and tag.has_attr("onclick")
-                )
+                onclick_func = html_parse.ONCLICK_LINK.select_one(time_div)
                 # Fix the layout change for 2012-2016 sessions
                 if not time_regex.search(onclick_func["onclick"]):
                     results[lang].append(
@@ -166,22 +173,21 @@ def get_speech_metadata(vp_link, multilingual=True, data_dir=None):
                         (label.text, time_regex.search(
                             onclick_func["onclick"]).group(2)))
 
-    driver.close()
-    driver.quit()
-
     if data_dir:
         metadata_path = os.path.join(data_dir, "metadata", mid)
         mkdir_if_not_exist(metadata_path)
-        with open(os.path.join(metadata_path, "clips.json"), "w") as f:
+        with open(clips_path(data_dir, mid), "w") as f:
             json.dump(results, f)
 
     return results
 
 
-def get_playlist_m3u8_link(vp_link, multilingual=True):
+def get_playlist_m3u8_link(vp_link, multilingual=True, block="player"):
     """
     @param vp_link: Link to the video page (in any language).
     @param multilingual: Returns chinese/english audio playlist link as well.
+    @param block: The resource-blocking profile of the browser, default is player (the
+    playlist.m3u8 request goes through, the media does not).
     @return: A dictionary with language ID as key and the corresponding
     playlist.m3u8 link as value. If multilingual=True, all three languages
     will be returned, otherwise only the Cantonese playlist link will be returned.
@@ -190,78 +196,40 @@ def get_playlist_m3u8_link(vp_link, multilingual=True):
     parsed_url = urlparse(vp_link)
     mid = parse_qs(parsed_url.query)["MeetingID"][0]
 
-    # Enable performance logging to record network requests/responses
-    desired_capabilities = DesiredCapabilities.CHROME
-    desired_capabilities["goog:loggingPrefs"] = {"performance": "ALL"}
-
-    options = Options()
-
-    # Chrome will start in Headless mode
-    options.add_argument("headless")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--ignore-certificate-errors")
-    options.add_argument("--allow-running-insecure-content")
-
-    # Crucial for the website to load videos
-    user_agent = USER_AGENT
-    options.add_argument(f"user-agent={user_agent}")
+    with driver_pool.lease(block=block) as driver:
+        # Discard the network logs of the previous pages of the driver
+        driver.get_log("performance")
+
+        # Returns as soon as the DOM is ready (eager page load strategy)
+        driver.get(vp_link)
+
+        # Resolve on the first playlist request of the player
+        playlist_link = driver_pool.wait_for_request(
+            driver, "playlist.m3u8", timeout=20)
+
+        # The logic below is based on the obervation that the playlist.m3u8 link follows
+        # the following pattern:
+        # hk: https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02/2016/10/mp4:M16100003_VC15.mp4/playlist.m3u8
+        # cn: https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02/2016/10/mp4:M16100003_VP15.mp4/playlist.m3u8
+        # en: https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02/2016/10/mp4:M16100003_VE15.mp4/playlist.m3u8
+        # where the pattern is indicated by the variable in an element:
+        # <span class="ctrl-group ctrl-onoff-on" data-ctrl-group="lang" data-value="C" id="ctrl-can2" tabindex="0">粵語</span>
+        WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.ID, "ctrl-can2")))
+        soup = html_parse.parse(
+            driver.page_source, only=html_parse.LANG_CTRL_ONLY)
+        hk_var = soup.find("span", {"id": "ctrl-can2"})["data-value"]
+        if multilingual:
+            cn_var = soup.find("span", {"id": "ctrl-pu2"})["data-value"]
+            en_var = soup.find("span", {"id": "ctrl-eng2"})["data-value"]
 
-    # Start the chrome webdriver with executable path
-    driver = webdriver.Chrome(
-        # executable_path="./chromedriver",
-        service=Service(ChromeDriverManager().install()),
-        options=options,
-        desired_capabilities=desired_capabilities,
-    )
+        # Abort the rest of the page load (the player starts fetching the video)
+        driver.execute_script("window.stop()")
 
-    # Send a request to the website and let it load
-    driver.get(vp_link)
-    WebDriverWait(driver, 20).until(
-        EC.presence_of_element_located(
-            (By.XPATH,
-             "//div[@class='jw-icon jw-icon-inline jw-text jw-reset jw-text-duration']")
-        )
-    )
+        # Useful code snippet for saving a screenshot of the browser for debugging
+        # driver.get_screenshot_as_file("screenshot.png")
 
-    # Gets all the logs from performance in Chrome
-    logs = driver.get_log("performance")
-
-    # The logic below is based on the obervation that the playlist.m3u8 link follows
-    # the following pattern:
-    # hk: https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02/2016/10/mp4:M16100003_VC15.mp4/playlist.m3u8
-    # cn: https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02/2016/10/mp4:M16100003_VP15.mp4/playlist.m3u8
-    # en: https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02/2016/10/mp4:M16100003_VE15.mp4/playlist.m3u8
-    # where the pattern is indicated by the variable in an element:
-    # <span class="ctrl-group ctrl-onoff-on" data-ctrl-group="lang" data-value="C" id="ctrl-can2" tabindex="0">粵語</span>
-    if multilingual:
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        hk_var = soup.find("span", {"id": "ctrl-can2"})["data-value"]
-        cn_var = soup.find("span", {"id": "ctrl-pu2"})["data-value"]
-        en_var = soup.find("span", {"id": "ctrl-eng2"})["data-value"]
-
-    # Useful code snippet for saving a screenshot of the browser for debugging
-    # driver.get_screenshot_as_file("screenshot.png")
-
-    # Iterates every log and parses it using JSON
-    result = {}
-    for log in logs:
-        network_log = json.loads(log["message"])["message"]
-
-        # Filter logs to find only interested entries
-        if (
-            (
-                "Network.response" in network_log["method"]
-                or "Network.request" in network_log["method"]
-            )
-            and "request" in network_log["params"].keys()
-            and "url" in network_log["params"]["request"]
-            and network_log["params"]["request"]["url"].endswith("playlist.m3u8")
-        ):
-            playlist_link = network_log["params"]["request"]["url"]
-            break
-
-    driver.close()
-    driver.quit()
+        result = {}
 
     delim = mid + "_V"
     splitted = playlist_link.split(delim)
@@ -275,21 +243,27 @@ def get_playlist_m3u8_link(vp_link, multilingual=True):
     return result
 
 
-def download_single_playlist_link(save_path, vp_link, multilingual=True):
+def download_single_playlist_link(save_path, vp_link, multilingual=True, predictor=None):
     """
     Download a single playlist.m3u8 link given the video page link and store the
     results in a specified path.
     @param save_path: The path in which the m3u8 link will be stored.
     @param vp_link: The link to the video page.
     @param multilingual: Download multilingual m3u8 links if True.
+    @param predictor: If given, a PlaylistPredictor tried before the browser.
     """
-    results = get_playlist_m3u8_link(
-        vp_link=vp_link, multilingual=multilingual)
+    results = predictor.predict(meeting_id(vp_link), multilingual) if predictor else None
+    if results is None:
+        results = get_playlist_m3u8_link(
+            vp_link=vp_link, multilingual=multilingual)
+        if predictor:
+            predictor.learn(results)
     with open(save_path, "w") as f:
         json.dump(results, f)
 
 
-def download_playtlist_m3u8_links(data_dir, multilingual=True, mthread=1):
+def download_playtlist_m3u8_links(data_dir, multilingual=True, mthread=1, incremental=False,
+                                  predict=True):
     """
     Download all playlist.m3u8 links based on the video page links stored in the
     metadata directory (data_dir/metadata/vp_links.json).
@@ -300,13 +274,25 @@ def download_playtlist_m3u8_links(data_dir, multilingual=True, mthread=1):
     @param data_dir: The data directory to store and extract data/metadata.
     @param multilingual: Download multilingual m3u8 links if True.
     @param mthread: The number of threads used to download the links.
+    @param incremental: Only resolve the meetings missing from the existing playlists.json and
+    merge them into it, default is False.
+    @param predict: Probe the predictable playlist links (from dates.json and the patterns of
+    playlists.json) with plain HTTP before loading the video page in a browser, default is True.
     """
     vp_links = read_vp_links(data_dir)
     save_path = os.path.join(data_dir, "metadata", "global", "playlists.json")
     tmp_path = os.path.join(data_dir, "metadata", "global", "tmp")
     session_dirs = {}
-    results = {}
+    existing = read_json(save_path, {}) if incremental else {}
+    langs = {"can", "man", "eng"} if multilingual else {"can"}
     os.environ["WDM_LOG"] = "0"  # Disable webdriver-manager logging
+    driver_pool.get_driver_pool(size=mthread)
+    predictor = None
+    if predict:
+        predictor = PlaylistPredictor(
+            dates=read_json(os.path.join(
+                data_dir, "metadata", "global", "dates.json"), {}),
+            playlists=read_json(save_path, {}))
 
     with ThreadPoolExecutor(max_workers=mthread) as pool:
         param_save_paths = []
@@ -317,10 +303,14 @@ def download_playtlist_m3u8_links(data_dir, multilingual=True, mthread=1):
             session_dirs[session] = session_tmp_path
             mkdir_if_not_exist(session_tmp_path)
             for mid, vp_link in meetings.items():
+                if langs <= existing.get(session, {}).get(mid, {}).keys():
+                    continue
                 # Download and store links separately
                 save_file_path = os.path.join(session_tmp_path, mid + ".json")
                 param_save_paths.append(save_file_path)
                 param_vp_links.append(vp_link)
+        if incremental:
+            print(f"{len(param_vp_links)} meetings without playlist links.")
 
         list(
             tqdm(
@@ -329,6 +319,7 @@ def download_playtlist_m3u8_links(data_dir, multilingual=True, mthread=1):
                     param_save_paths,
                     param_vp_links,
                     [multilingual] * len(param_save_paths),
+                    [predictor] * len(param_save_paths),
                 ),
                 total=len(param_save_paths),
                 position=0,
@@ -336,8 +327,12 @@ def download_playtlist_m3u8_links(data_dir, multilingual=True, mthread=1):
             )
         )
 
+    if predictor:
+        print(predictor.report())
+        predictor.close()
+
     # Merge session-level results, e.g. 1617 represents the 2016-2017 session
-    session_results = {}
+    session_results = existing
     for session, session_dir in session_dirs.items():
         session_result = {}
         for fname in os.listdir(session_dir):
@@ -347,11 +342,10 @@ def download_playtlist_m3u8_links(data_dir, multilingual=True, mthread=1):
                     session_result[fname.split(".json")[0]] = json.load(f)
                 os.remove(file_path)
         os.rmdir(session_dir)
-        session_results[session] = session_result
+        session_results.setdefault(session, {}).update(session_result)
 
     # Store results in the file data_dir/metadata/global/playlists.json
-    with open(save_path, "w") as f:
-        json.dump(session_results, f)
+    write_json(save_path, session_results)
     os.rmdir(tmp_path)
 
 
@@ -362,49 +356,33 @@ def get_video_page_link(index_page_link):
     https://www.legco.gov.hk/general/chinese/counmtg/yr16-20/mtg_1617.htm#toptbl
     @return: A dictionary with the MeetingID as the key and video page link as value.
     """
-    options = Options()
-
-    # Chrome will start in Headless mode
-    options.add_argument("headless")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--ignore-certificate-errors")
-    options.add_argument("--allow-running-insecure-content")
+    return parse_vp_links(fetch_index_page(index_page_link))
 
-    # Crucial for the website to load videos
-    user_agent = USER_AGENT
-    options.add_argument(f"user-agent={user_agent}")
 
-    # Start the chrome webdriver with executable path
-    driver = webdriver.Chrome(
-        service=Service(ChromeDriverManager().install()),
-        options=options,
-    )
-
-    # Send a request to the website and let it load
-    driver.get(index_page_link)
-    res = driver.page_source
-
-    soup = BeautifulSoup(res, "html.parser")
+def fetch_index_page(index_page_link):
+    """
+    @return: The index table of an index page.
+    """
+    # The index page is static, the browser is only a fallback
+    soup = page_fetch.fetch_soup(
+        index_page_link, expected="table[border='1'] a.webcast_link", wait=10,
+        only=html_parse.INDEX_ONLY)
+    return html_parse.INDEX_TABLE.select_one(soup)
 
-    # Get page langauge
-    # lang = soup.find("html").attrs["lang"]
 
-    table = soup.find(
-        lambda tag: tag.name == "table" and tag.has_attr(
-            "border") and tag["border"] == "1"
-    )
-    rows = table.find_all(lambda tag: tag.name == "tr")
+def parse_vp_links(table):
+    """
+    @param table: The index table of an index page (in any language).
+    @return: A dictionary with the MeetingID as the key and video page link as value.
+    """
+    rows = html_parse.ROW.select(table)
     results = {}
     for row in rows:
-        found_vp_links = row.find_all("a", {"class": "webcast_link"})
+        found_vp_links = html_parse.WEBCAST_LINK.select(row)
         for found_vp_link in found_vp_links:
-            if "href" in found_vp_link.attrs:
-                parsed_url = urlparse(found_vp_link["href"])
-                mid = parse_qs(parsed_url.query)["MeetingID"][0]
-                results[mid] = found_vp_link["href"]
-
-    driver.close()
-    driver.quit()
+            parsed_url = urlparse(found_vp_link["href"])
+            mid = parse_qs(parsed_url.query)["MeetingID"][0]
+            results[mid] = found_vp_link["href"]
 
     return results
 
@@ -442,147 +420,211 @@ def read_vp_links(data_dir):
     return results
 
 
-def download_vp_links(data_dir):
+def download_vp_links(data_dir, incremental=False):
     """
     Download the video page links and store the results in data_dir/metadata/global/vp_links.json.
     Note that the index page links must be stored already in the metadata directory.
     The json object stored is in the format {session: {mid: vp_link}}.
+    @param incremental: Merge the discovered links into the existing vp_links.json, default is
+    False. The playlists and metadata of the meetings whose link changed are invalidated, so that
+    the incremental playlist and metadata downloads resolve them again.
+    @return: The set of new or changed meeting IDs.
     """
     ip_links = read_index_page_links(data_dir)
+    http_cache.get_cache(os.path.join(data_dir, "cache", "http"))
+    return save_vp_links(data_dir, {session: get_video_page_link(ip_link)
+                                    for session, ip_link in ip_links.items()}, incremental)
+
+
+def save_vp_links(data_dir, vp_links, incremental=False):
+    """
+    Store the video page links in data_dir/metadata/global/vp_links.json.
+    @param vp_links: The discovered links {session: {mid: vp_link}}.
+    @param incremental: Merge the links into the existing file, see download_vp_links.
+    @return: The set of new or changed meeting IDs.
+    """
     save_path = os.path.join(data_dir, "metadata", "global", "vp_links.json")
-    results = {}
+    results = read_json(save_path, {}) if incremental else {}
 
-    for session, vp_link in ip_links.items():
-        results[session] = get_video_page_link(vp_link)
+    new_mids = set()
+    changed_mids = set()
+    for session, session_links in vp_links.items():
+        session_results = results.setdefault(session, {})
+        for mid, link in session_links.items():
+            if mid not in session_results:
+                new_mids.add(mid)
+            elif session_results[mid] != link:
+                changed_mids.add(mid)
+            session_results[mid] = link
 
-    with open(save_path, "w") as f:
-        json.dump(results, f)
+    if incremental:
+        invalidate_meetings(data_dir, changed_mids)
+        print(f"{len(new_mids)} new and {len(changed_mids)} changed meetings.")
 
+    write_json(save_path, results)
+    return new_mids | changed_mids
 
-def download_session_scripts(index_page_link, data_dir):
+
+def invalidate_meetings(data_dir, mids):
     """
-    Download all pdf scripts given the index page link.
-    @param index_page_link: The link to the index page, e.g.
-    https://www.legco.gov.hk/general/chinese/counmtg/yr16-20/mtg_1617.htm#toptbl
-    The downloaded pdf will be stored at data_dir/txt/mid/lang/mid_lang.pdf, e.g.
-    ../data/txt/M16100003/eng/M16100003_eng.pdf
+    Remove the playlist links and the metadata of some meetings.
+    @param data_dir: The data directory to store and extract data/metadata.
+    @param mids: The meeting IDs.
     """
-    root_domain = urlparse(index_page_link).hostname
+    if not mids:
+        return
+    playlists_path = os.path.join(
+        data_dir, "metadata", "global", "playlists.json")
+    playlists = read_json(playlists_path, None)
+    if playlists is not None:
+        for meetings in playlists.values():
+            for mid in mids:
+                meetings.pop(mid, None)
+        write_json(playlists_path, playlists)
+
+    for mid in mids:
+        if os.path.exists(clips_path(data_dir, mid)):
+            os.remove(clips_path(data_dir, mid))
+
+
+def meeting_id(vp_link):
+    """
+    @return: The MeetingID of a video page link.
+    """
+    return parse_qs(urlparse(vp_link).query)["MeetingID"][0]
 
-    options = Options()
 
-    # Chrome will start in Headless mode
-    options.add_argument("headless")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--ignore-certificate-errors")
-    options.add_argument("--allow-running-insecure-content")
+def clips_path(data_dir, mid):
+    return os.path.join(data_dir, "metadata", mid, "clips.json")
 
-    # Crucial for the website to load videos
-    user_agent = USER_AGENT
-    options.add_argument(f"user-agent={user_agent}")
 
-    # Start the chrome webdriver with executable path
-    driver = webdriver.Chrome(
-        service=Service(ChromeDriverManager().install()),
-        options=options,
-    )
+def read_json(path, default):
+    """
+    @return: The content of a json file, or default if it does not exist.
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path, "r") as f:
+        return json.load(f)
 
-    # Send a request to the website and let it load
-    driver.get(index_page_link)
-    res = driver.page_source
 
-    soup = BeautifulSoup(res, "html.parser")
+def write_json(path, obj):
+    """
+    Atomically replace a json file, so that an interrupted run keeps the previous results.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
 
-    table = soup.find(
-        lambda tag: tag.name == "table" and tag.has_attr(
-            "border") and tag["border"] == "1"
-    )
-    rows = table.find_all(lambda tag: tag.name == "tr")
 
-    headers = {"User-Agent": USER_AGENT}
+def download_session_scripts(index_page_link, data_dir, mthread=8):
+    """
+    Download all pdf scripts given the index page link.
+    @param index_page_link: The link to the index page, e.g.
+    https://www.legco.gov.hk/general/chinese/counmtg/yr16-20/mtg_1617.htm#toptbl
+    @param data_dir: The data directory to store the scripts.
+    @param mthread: The number of threads resolving script pages and downloading pdfs, default is 8.
+    The downloaded pdf will be stored at data_dir/txt/mid/lang/mid_lang.pdf, e.g.
+    ../data/txt/M16100003/eng/M16100003_eng.pdf
+    """
     txt_path = os.path.join(data_dir, "txt")
+    script_pages = parse_script_pages(
+        fetch_index_page(index_page_link), index_page_link, txt_path)
+    downloaded = download_scripts(script_pages, mthread=mthread)
+    print(f"{sum(downloaded)} pdfs downloaded, {len(downloaded) - sum(downloaded)} up to date "
+          f"({index_page_link}).")
 
-    for row in tqdm(rows):
-        td_cells = row.find_all("td", {"valign": "top", "align": "center"})
+
+def parse_script_pages(table, index_page_link, txt_path):
+    """
+    Find the script pages of a (chinese) index page.
+    @param table: The index table of the index page.
+    @param index_page_link: The link to the index page.
+    @param txt_path: The directory of the scripts.
+    @return: A dictionary {save_file: script_page_link}, see script_path.
+    """
+    root_domain = urlparse(index_page_link).hostname
+    rows = html_parse.ROW.select(table)
+    script_pages = {}
+    for row in rows:
+        td_cells = html_parse.SCRIPT_CELL.select(row)
         # Valid rows contain 4 cells with centering format
         if len(td_cells) < 4:
             continue
         can_script_cell = td_cells[-1]
         eng_script_cell = td_cells[-2]
-        can_script_page_as = can_script_cell.find_all(
-            lambda tag: tag.name == "a"
-            and tag.has_attr("href")
-            and not tag["href"].endswith(".pdf")
-        )
-        eng_script_page_as = eng_script_cell.find_all(
-            lambda tag: tag.name == "a"
-            and tag.has_attr("href")
-            and not tag["href"].endswith(".pdf")
-        )
-        can_script_page_links = [
-            "https://" + root_domain + a["href"] for a in can_script_page_as]
-        eng_script_page_links = [
-            "https://" + root_domain + a["href"].replace("chinese", "english")
-            for a in eng_script_page_as
-        ]
-
-        for i, script_page_link in enumerate(can_script_page_links):
-            # Using script date as identifier to resolve video-script many-to-one mapping
-            parsed_script_url = urlparse(script_page_link)
-            script_date = parse_qs(parsed_script_url.query)["date"][0]
-            driver.get(script_page_link)
-            WebDriverWait(driver, 3).until(
-                EC.presence_of_element_located(
-                    (By.XPATH, "//a[@class='pdf-links item1']"))
-            )
-            sp_soup = BeautifulSoup(driver.page_source, "html.parser")
-            pdf_link_a = sp_soup.find("a", {"class": "pdf-links item1"})
-            pdf_link = "https:" + pdf_link_a["href"]
-
-            # pdf_res = requests.get(pdf_link, headers=headers)
-            request = Request(pdf_link, headers=headers)
-            pdf_res = urlopen(
-                request, context=ssl._create_default_https_context(cafile=certifi.where()))
-            save_dir = os.path.join(txt_path, script_date, "can")
-            mkdir_if_not_exist(save_dir)
-            save_file = os.path.join(save_dir, script_date + "_can.pdf")
-            with open(save_file, "wb") as f:
-                # f.write(pdf_res.content)
-                f.write(pdf_res.read())
-
-        for i, script_page_link in enumerate(eng_script_page_links):
-            # Using script date as identifier to resolve video-script many-to-one mapping
-            parsed_script_url = urlparse(script_page_link)
-            script_date = parse_qs(parsed_script_url.query)["date"][0]
-            driver.get(script_page_link)
-            WebDriverWait(driver, 3).until(
-                EC.presence_of_element_located(
-                    (By.XPATH, "//a[@class='pdf-links item1']"))
-            )
-            sp_soup = BeautifulSoup(driver.page_source, "html.parser")
-            pdf_link_a = sp_soup.find("a", {"class": "pdf-links item1"})
-            pdf_link = "https:" + pdf_link_a["href"]
+        for a in html_parse.SCRIPT_PAGE_LINK.select(can_script_cell):
+            script_page_link = "https://" + root_domain + a["href"]
+            script_pages[script_path(txt_path, script_page_link, "can")] = script_page_link
+        for a in html_parse.SCRIPT_PAGE_LINK.select(eng_script_cell):
+            script_page_link = "https://" + root_domain + \
+                a["href"].replace("chinese", "english")
+            script_pages[script_path(txt_path, script_page_link, "eng")] = script_page_link
 
-            # pdf_res = requests.get(pdf_link, headers=headers)
-            request = Request(pdf_link, headers=headers)
-            pdf_res = urlopen(
-                request, context=ssl._create_default_https_context(cafile=certifi.where()))
-            save_dir = os.path.join(txt_path, script_date, "eng")
-            mkdir_if_not_exist(save_dir)
-            save_file = os.path.join(save_dir, script_date + "_eng.pdf")
-            with open(save_file, "wb") as f:
-                # f.write(pdf_res.content)
-                f.write(pdf_res.read())
+    return script_pages
+
+
+def download_scripts(script_pages, mthread=8):
+    """
+    Resolve the pdf links of script pages and download the pdfs as soon as they are found.
+    @param script_pages: A dictionary {save_file: script_page_link}.
+    @param mthread: The number of threads resolving script pages and downloading pdfs.
+    @return: The list of whether each pdf was downloaded (False if up to date).
+    """
+    http_client.get_session(pool_size=2 * mthread)
+    with ThreadPoolExecutor(max_workers=mthread) as page_pool, \
+            ThreadPoolExecutor(max_workers=mthread) as pdf_pool:
+        page_futures = {page_pool.submit(get_script_pdf_link, script_page_link): save_file
+                        for save_file, script_page_link in script_pages.items()}
+        pdf_futures = []
+        for future in as_completed(page_futures):
+            pdf_futures.append(pdf_pool.submit(
+                download_script_pdf, future.result(), page_futures[future]))
 
-    driver.close()
-    driver.quit()
+        return [future.result() for future in tqdm(
+            as_completed(pdf_futures), total=len(pdf_futures), leave=False)]
 
 
-def download_target_scripts(data_dir, target_sessions="all", mthread=5):
+def script_path(txt_path, script_page_link, lang):
+    """
+    @return: The path of the pdf of a script page, e.g. txt_path/2016-10-12/eng/2016-10-12_eng.pdf.
+    """
+    # Using script date as identifier to resolve video-script many-to-one mapping
+    script_date = parse_qs(urlparse(script_page_link).query)["date"][0]
+    return os.path.join(txt_path, script_date, lang, f"{script_date}_{lang}.pdf")
+
+
+def get_script_pdf_link(script_page_link):
+    """
+    @return: The link to the pdf of a script page.
+    """
+    sp_soup = page_fetch.fetch_soup(
+        script_page_link, expected="a.pdf-links.item1", wait=3,
+        only=html_parse.PDF_LINKS_ONLY)
+    pdf_link_a = html_parse.PDF_LINK.select_one(sp_soup)
+    return "https:" + pdf_link_a["href"]
+
+
+def download_script_pdf(pdf_link, save_file):
+    """
+    Stream a pdf to disk, skipped if it is not modified since the last crawl or if the file on
+    disk already has the same size.
+    @return: Whether the pdf was downloaded.
+    """
+    mkdir_if_not_exist(os.path.dirname(save_file))
+    return http_cache.get_cache().download(
+        pdf_link, save_file, headers={"User-Agent": USER_AGENT}, verify=False)
+
+
+def download_target_scripts(data_dir, target_sessions="all", mthread=5, script_mthread=8):
     """
     Download all sessions scripts.
     @param data_dir: The data directory for storage and reading pre-stored index pages.
     @param target_sessions: The list of target sessions. Default is all.
+    @param mthread: The number of sessions processed concurrently, default is 5.
+    @param script_mthread: The number of threads per session resolving script pages and
+    downloading pdfs, default is 8.
     """
     target_sessions = (
         [target_sessions]
@@ -592,12 +634,15 @@ def download_target_scripts(data_dir, target_sessions="all", mthread=5):
     mthread = min(len(target_sessions),
                   mthread) if target_sessions != "all" else mthread
     ip_links = read_index_page_links(data_dir=data_dir)
+    driver_pool.get_driver_pool(size=mthread)
+    http_cache.get_cache(os.path.join(data_dir, "cache", "http"))
+    http_client.get_session(pool_size=2 * mthread * script_mthread)
     with ThreadPoolExecutor(max_workers=mthread) as pool:
         futures = []
         for session, ip_link in ip_links.items():
             if session in target_sessions and target_sessions != "all" or target_sessions == "all":
                 futures.append(pool.submit(
-                    download_session_scripts, ip_link, data_dir))
+                    download_session_scripts, ip_link, data_dir, script_mthread))
 
         # For exception passing
         results = wait(futures)
@@ -612,60 +657,34 @@ def get_video_dates(eng_index_page_link):
     @param eng_index_page_link: The english index page link.
     @return: A dictionary {mid: date}.
     """
-    options = Options()
-
-    # Chrome will start in Headless mode
-    options.add_argument("headless")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--ignore-certificate-errors")
-    options.add_argument("--allow-running-insecure-content")
+    return parse_video_dates(fetch_index_page(eng_index_page_link))
 
-    # Crucial for the website to load videos
-    user_agent = USER_AGENT
-    options.add_argument(f"user-agent={user_agent}")
-
-    # Start the chrome webdriver with executable path
-    driver = webdriver.Chrome(
-        service=Service(ChromeDriverManager().install()),
-        options=options,
-    )
 
-    # Send a request to the website and let it load
-    driver.get(eng_index_page_link)
-    res = driver.page_source
-
-    soup = BeautifulSoup(res, "html.parser")
-
-    table = soup.find(
-        lambda tag: tag.name == "table" and tag.has_attr(
-            "border") and tag["border"] == "1"
-    )
-    rows = table.find_all(lambda tag: tag.name == "tr")
+def parse_video_dates(table):
+    """
+    @param table: The index table of an english index page.
+    @return: A dictionary {mid: date}.
+    """
+    rows = html_parse.ROW.select(table)
     results = {}
 
     # Using English index page for simplicity, allowing for simple regex matching of
     # d(d).m(m).yyyy
     date_regex = re.compile(r"(\d{1,2}).(\d{1,2}).(\d\d\d\d)$")
     for row in rows:
-        found_vp_links = row.find_all("a", {"class": "webcast_link"})
+        found_vp_links = html_parse.WEBCAST_LINK.select(row)
         for found_vp_link in found_vp_links:
-            if "href" in found_vp_link.attrs:
-                parsed_url = urlparse(found_vp_link["href"])
-                mid = parse_qs(parsed_url.query)["MeetingID"][0]
-                title = found_vp_link.find(lambda tag: tag.name == "img" and tag.has_attr("title"))[
-                    "title"
+            parsed_url = urlparse(found_vp_link["href"])
+            mid = parse_qs(parsed_url.query)["MeetingID"][0]
+            title = html_parse.TITLED_IMG.select_one(found_vp_link)["title"]
+            date = "-".join(
+                [
+                    date_regex.search(title).group(3),
+                    date_regex.search(title).group(2).zfill(2),
+                    date_regex.search(title).group(1).zfill(2),
                 ]
-                date = "-".join(
-                    [
-                        date_regex.search(title).group(3),
-                        date_regex.search(title).group(2).zfill(2),
-                        date_regex.search(title).group(1).zfill(2),
-                    ]
-                )
-                results[mid] = date
-
-    driver.close()
-    driver.quit()
+            )
+            results[mid] = date
 
     return results
 
@@ -678,6 +697,7 @@ def download_all_video_dates(data_dir):
     metadata_dir = os.path.join(data_dir, "metadata", "global")
     ip_links = read_index_page_links(data_dir=data_dir)
     results = {}
+    http_cache.get_cache(os.path.join(data_dir, "cache", "http"))
 
     for _, ip_link in ip_links.items():
         results = {**results, **
@@ -687,6 +707,65 @@ def download_all_video_dates(data_dir):
         json.dump(results, f)
 
 
+def extract_index_page(index_page_link, txt_path):
+    """
+    Extract everything the crawler needs from an index page in a single pass: the chinese and
+    the english index pages are fetched and parsed once each.
+    @param index_page_link: The link to the (chinese) index page.
+    @param txt_path: The directory of the scripts.
+    @return: A tuple (vp_links, dates, script_pages), see get_video_page_link, get_video_dates
+    and parse_script_pages.
+    """
+    table = fetch_index_page(index_page_link)
+    eng_table = fetch_index_page(index_page_link.replace("chinese", "english"))
+    return (
+        parse_vp_links(table),
+        parse_video_dates(eng_table),
+        parse_script_pages(table, index_page_link, txt_path),
+    )
+
+
+def download_index_data(data_dir, scripts=True, mthread=5, script_mthread=8, incremental=False):
+    """
+    Refresh everything that comes from the index pages (video page links, dates and scripts),
+    replacing separate calls of download_vp_links, download_all_video_dates and
+    download_target_scripts. All sessions are extracted concurrently.
+    @param data_dir: The data directory to store and extract data/metadata.
+    @param scripts: Download the pdf scripts as well, default is True.
+    @param mthread: The number of sessions extracted concurrently, default is 5.
+    @param script_mthread: The number of threads resolving script pages and downloading pdfs.
+    @param incremental: Merge the video page links into the existing vp_links.json, see
+    download_vp_links.
+    @return: The set of new or changed meeting IDs.
+    """
+    ip_links = read_index_page_links(data_dir)
+    txt_path = os.path.join(data_dir, "txt")
+    driver_pool.get_driver_pool(size=mthread)
+    http_cache.get_cache(os.path.join(data_dir, "cache", "http"))
+    http_client.get_session(pool_size=max(2 * mthread, 2 * script_mthread))
+
+    with ThreadPoolExecutor(max_workers=mthread) as pool:
+        futures = {session: pool.submit(extract_index_page, ip_link, txt_path)
+                   for session, ip_link in ip_links.items()}
+        extracted = {session: future.result()
+                     for session, future in futures.items()}
+
+    vp_links = {session: result[0] for session, result in extracted.items()}
+    dates = {}
+    script_pages = {}
+    for _, session_dates, session_script_pages in extracted.values():
+        dates.update(session_dates)
+        script_pages.update(session_script_pages)
+
+    changed = save_vp_links(data_dir, vp_links, incremental)
+    write_json(os.path.join(data_dir, "metadata", "global", "dates.json"), dates)
+    if scripts:
+        downloaded = download_scripts(script_pages, mthread=script_mthread)
+        print(f"{sum(downloaded)} pdfs downloaded, "
+              f"{len(downloaded) - sum(downloaded)} up to date.")
+    return changed
+
+
 def main():
     logging.basicConfig(
         level="INFO",
@@ -708,6 +787,7 @@ def main():
     # download_target_scripts(DATA_DIR, target_sessions="1617")
     # download_target_scripts(DATA_DIR)
     # download_all_video_dates(DATA_DIR)
+    # download_index_data(DATA_DIR, incremental=True)
 
     # sample_vp_link = list(sample_vp_links.keys())[0]
     # sample_vp_link = "http://webcast.legco.gov.hk/public/zh-hk/SearchResult?MeetingID=M16100003"
@@ -0,0 +1,89 @@
+"""
+Page fetching for the crawler: plain HTTP first, headless Chrome as fallback.
+
+Most pages we scrape (index pages, script pages, video pages) are static
+tables that do not need a browser. A page is fetched with the pooled HTTP
+client and only loaded in a leased Chrome driver when the expected elements
+are missing from the static html (e.g. when they are rendered by javascript).
+
+Both paths go through the on-disk HTTP cache: static pages are revalidated
+with conditional requests, and a rendered page is reused as long as the static
+page it comes from is not modified.
+"""
+
+import requests
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+import http_cache
+import driver_pool
+from html_parse import parse
+
+
+def _fetch(url):
+    """
+    @return: A tuple (body, validator) of the page, (None, None) if the request failed.
+    """
+    try:
+        # Some of the legco hosts serve an incomplete certificate chain
+        return http_cache.get_cache().get(url, verify=False)
+    except requests.RequestException:
+        return None, None
+
+
+def fetch_html(url):
+    """
+    Fetch a page with a plain HTTP request (through the cache).
+    @return: The raw body, or None if the request failed.
+    """
+    return _fetch(url)[0]
+
+
+def fetch_soup(url, expected=None, script=None, wait=0, browser_only=False, only=None,
+               block="page"):
+    """
+    Fetch and parse a page.
+    @param url: The link to the page.
+    @param expected: CSS selector of an element the page must contain for the plain HTTP result to
+    be used, otherwise the page is loaded in a browser.
+    @param script: Javascript executed in the browser after the page is loaded (browser only).
+    @param wait: Seconds to wait in the browser for the expected element to be present. The
+    browsers load pages eagerly (page_source is read once the DOM is ready, see driver_pool), so
+    elements rendered by scripts need a wait.
+    @param browser_only: Whether to skip the plain HTTP attempt, default is False.
+    @param only: Optional SoupStrainer restricting the parse to the subtrees that are needed
+    (expected must match within them).
+    @param block: The resource-blocking profile of the browser, default is page (no images, fonts
+    and analytics).
+    @return: The BeautifulSoup of the page.
+    """
+    validator = None
+    if not browser_only:
+        html, validator = _fetch(url)
+        if html is not None:
+            # Parsing the bytes lets BeautifulSoup pick up the charset of the page
+            soup = parse(html, only=only)
+            if expected is None or soup.select_one(expected) is not None:
+                return soup
+
+    # The rendering of an unmodified static page is reused
+    cache = http_cache.get_cache()
+    rendered_key = f"rendered:{script or ''}:{url}"
+    if validator is not None:
+        html = cache.lookup(rendered_key, validator)
+        if html is not None:
+            return parse(html.decode("utf-8"), only=only)
+
+    with driver_pool.lease(block=block) as driver:
+        driver.get(url)
+        if script:
+            driver.execute_script(script)
+        if wait and expected:
+            WebDriverWait(driver, wait).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, expected))
+            )
+        html = driver.page_source
+
+    if validator is not None:
+        cache.store(rendered_key, html.encode("utf-8"), etag=validator)
+    return parse(html, only=only)
@@ -0,0 +1,166 @@
+"""
+Browserless resolution of the playlist.m3u8 links of the meetings.
+
+The playlist links follow a deterministic pattern, e.g.
+https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02/2016/10/mp4:M16100003_VC15.mp4/playlist.m3u8
+i.e. <prefix>/<year>/<month>/mp4:<mid>_V<language code><suffix>.mp4/playlist.m3u8.
+Candidate links are built from the meeting ID, its date (dates.json) and the
+prefixes and suffixes seen in the already resolved links (playlists.json), and
+probed in parallel with plain HTTP requests. The browser is only needed for
+the meetings where no candidate is a playlist.
+"""
+
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import http_client
+
+# Default language codes of the playlists (data-value of ctrl-can2, ctrl-pu2 and ctrl-eng2)
+LANG_CODES = {"can": "C", "man": "P", "eng": "E"}
+
+# Patterns known before any link is resolved
+DEFAULT_PREFIXES = ["https://5b4c10ababf6d.streamlock.net//VODonSAN/_definst_/s02"]
+DEFAULT_SUFFIXES = ["15"]
+
+# Timeout (connect, read) of the probes in seconds
+PROBE_TIMEOUT = (5, 10)
+
+PLAYLIST_REGEX = re.compile(
+    r"^(.+)/(\d{4})/(\d{2})/mp4:(M\d+)_V([A-Z])(\w*)\.mp4/playlist\.m3u8$")
+
+
+def probe(link):
+    """
+    @return: Whether link is a m3u8 playlist.
+    """
+    try:
+        res = http_client.get(link, timeout=PROBE_TIMEOUT)
+    except requests.RequestException:
+        return False
+    return res.status_code == 200 and res.text.startswith("#EXTM3U")
+
+
+class PlaylistPredictor:
+    def __init__(self, dates=None, playlists=None, mthread=16, max_patterns=4):
+        """
+        @param dates: The meeting dates {mid: yyyy-mm-dd} (dates.json).
+        @param playlists: The resolved links {session: {mid: {lang: link}}} (playlists.json) the
+        prefixes and suffixes are learnt from.
+        @param mthread: The number of concurrent probes, default is 16.
+        @param max_patterns: The number of most frequent prefixes (and suffixes) tried, default is 4.
+        """
+        self.dates = dates or {}
+        self.max_patterns = max_patterns
+        self._prefixes = Counter()
+        self._suffixes = Counter()
+        self._codes = {lang: Counter() for lang in LANG_CODES}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=mthread)
+        http_client.get_session(pool_size=mthread)
+        self.hits = 0
+        self.misses = 0
+        for meetings in (playlists or {}).values():
+            for links in meetings.values():
+                self.learn(links)
+
+    def learn(self, links):
+        """
+        Learn the prefix, language code and suffix patterns of resolved links.
+        @param links: A dictionary {lang: link}.
+        """
+        with self._lock:
+            for lang, link in links.items():
+                match = PLAYLIST_REGEX.match(link)
+                if match:
+                    self._prefixes[match.group(1)] += 1
+                    self._suffixes[match.group(6)] += 1
+                    if lang in self._codes:
+                        self._codes[lang][match.group(5)] += 1
+
+    def code(self, lang):
+        """
+        @return: The most frequent language code of a language.
+        """
+        with self._lock:
+            common = self._codes[lang].most_common(1)
+        return common[0][0] if common else LANG_CODES[lang]
+
+    def _patterns(self, counter, defaults):
+        with self._lock:
+            patterns = [pattern for pattern, _ in counter.most_common(self.max_patterns)]
+        return patterns + [pattern for pattern in defaults if pattern not in patterns]
+
+    def _months(self, mid):
+        """
+        @return: The candidate (year, month) of a meeting: its date, then the one of its ID
+        (e.g. M16100003 -> 2016/10).
+        """
+        months = []
+        if mid in self.dates:
+            year, month = self.dates[mid].split("-")[:2]
+            months.append((year, month))
+        months.append(("20" + mid[1:3], mid[3:5]))
+        return list(dict.fromkeys(months))
+
+    def candidates(self, mid, lang="can"):
+        """
+        @return: The candidate playlist links of a meeting, most likely first.
+        """
+        return [
+            f"{prefix}/{year}/{month}/mp4:{mid}_V{self.code(lang)}{suffix}.mp4/playlist.m3u8"
+            for year, month in self._months(mid)
+            for prefix in self._patterns(self._prefixes, DEFAULT_PREFIXES)
+            for suffix in self._patterns(self._suffixes, DEFAULT_SUFFIXES)
+        ]
+
+    def _first_valid(self, links):
+        """
+        Probe links in parallel.
+        @return: The first link (in the order of links) that is a playlist, or None.
+        """
+        futures = [self._pool.submit(probe, link) for link in links]
+        for link, future in zip(links, futures):
+            if future.result():
+                for other in futures:
+                    other.cancel()
+                return link
+        return None
+
+    def predict(self, mid, multilingual=True):
+        """
+        Resolve the playlist links of a meeting without a browser.
+        @param mid: The MeetingID.
+        @param multilingual: Resolve the chinese/english audio playlist links as well.
+        @return: A dictionary {lang: link} as returned by get_playlist_m3u8_link, or None if a
+        link could not be validated.
+        """
+        link = self._first_valid(self.candidates(mid, "can"))
+        if link is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        result = {"can": link}
+        if multilingual:
+            # The other languages only differ by the language code
+            delim = mid + "_V"
+            head, tail = link.split(delim)
+            others = {lang: f"{head}{delim}{self.code(lang)}{tail[1:]}" for lang in ("man", "eng")}
+            futures = {lang: self._pool.submit(probe, other) for lang, other in others.items()}
+            if not all(future.result() for future in futures.values()):
+                with self._lock:
+                    self.misses += 1
+                return None
+            result.update(others)
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def report(self):
+        return f"{self.hits} playlists predicted, {self.misses} resolved in a browser"
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,148 @@
+"""
+SQLite-backed store of the downloaded videos.
+
+Replaces the downloaded.json list: membership checks are index lookups,
+every record is committed atomically, and several processes can share one
+store (WAL journal plus a busy timeout). Existing downloaded.json files are
+imported the first time the corresponding store is opened. Videos that failed
+to download are recorded as well, so that persistently failing ones can be
+quarantined.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+
+class ProgressStore:
+    def __init__(self, path, timeout=60):
+        """
+        @param path: The path of the SQLite database, created if it does not exist.
+        @param timeout: Seconds to wait for a lock held by another writer, default is 60.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS downloaded (fname TEXT PRIMARY KEY, finished_at REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS failed "
+            "(fname TEXT PRIMARY KEY, failures INTEGER, error TEXT, failed_at REAL)")
+
+    def __contains__(self, fname):
+        row = self._conn.execute(
+            "SELECT 1 FROM downloaded WHERE fname = ?", (fname,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM downloaded").fetchone()[0]
+
+    def add(self, fname):
+        """
+        Record a downloaded video (no-op if already recorded).
+        @param fname: The video file name, e.g. M16100003_can.mp4.
+        """
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO downloaded VALUES (?, ?)", (fname, time.time()))
+            self._conn.execute("DELETE FROM failed WHERE fname = ?", (fname,))
+
+    def update(self, fnames):
+        """
+        Record several downloaded videos in a single transaction.
+        """
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO downloaded VALUES (?, ?)", [(fname, now) for fname in fnames])
+
+    def add_failure(self, fname, error):
+        """
+        Record a failed download attempt of a video.
+        @param fname: The video file name.
+        @param error: The description of the error.
+        """
+        self._conn.execute(
+            "INSERT INTO failed VALUES (?, 1, ?, ?) ON CONFLICT(fname) DO UPDATE SET "
+            "failures = failures + 1, error = excluded.error, failed_at = excluded.failed_at",
+            (fname, str(error), time.time()),
+        )
+
+    def failure_count(self, fname):
+        """
+        @return: The number of failed download attempts of a video since its last success.
+        """
+        row = self._conn.execute(
+            "SELECT failures FROM failed WHERE fname = ?", (fname,)).fetchone()
+        return row[0] if row else 0
+
+    def failures(self):
+        """
+        @return: A dictionary {fname: (failures, last error)} of the videos that failed.
+        """
+        return {row[0]: (row[1], row[2]) for row in self._conn.execute(
+            "SELECT fname, failures, error FROM failed")}
+
+    def names(self):
+        """
+        @return: The set of all recorded video file names.
+        """
+        return {row[0] for row in self._conn.execute("SELECT fname FROM downloaded")}
+
+    def import_json(self, json_path):
+        """
+        Import a legacy downloaded.json list.
+        """
+        with open(json_path, "r") as f:
+            self.update(json.load(f))
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def legacy_path(data_dir, proglog=None):
+    """
+    @return: The path of the legacy downloaded.json list designated by proglog (see open_progress),
+    or None if proglog is a .db store.
+    """
+    proglog = str(proglog) if proglog else os.path.join(
+        data_dir, "metadata", "global", "downloaded.json")
+    return proglog if proglog.endswith(".json") else None
+
+
+def progress_path(data_dir, proglog=None):
+    """
+    @return: The path of the SQLite progress store designated by proglog, see open_progress.
+    """
+    json_path = legacy_path(data_dir, proglog)
+    if json_path is None:
+        return str(proglog)
+    return os.path.splitext(json_path)[0] + ".db"
+
+
+def open_progress(data_dir, proglog=None):
+    """
+    Open the progress store of a data directory.
+    @param data_dir: The data directory to store and extract data/metadata.
+    @param proglog: The path of the progress file, default is data_dir/metadata/global/downloaded.json.
+    A .json path refers to a legacy list, which is imported into the store next to it (same name
+    with the .db suffix) the first time the store is created.
+    @return: The ProgressStore.
+    """
+    db_path = progress_path(data_dir, proglog)
+    exists = os.path.exists(db_path)
+    store = ProgressStore(db_path)
+    json_path = legacy_path(data_dir, proglog)
+    if not exists and json_path is not None and os.path.exists(json_path):
+        store.import_json(json_path)
+    return store
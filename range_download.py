@@ -0,0 +1,193 @@
+"""
+Multi-connection download of large single files.
+
+The file is split into byte ranges fetched over parallel connections and
+written in place (pwrite) into a preallocated <path>.part file. The progress
+of every range is saved to <path>.ranges.json, so that a failed or interrupted
+download only fetches the missing bytes of each range. Servers that do not
+support ranges (or files too small to be worth splitting) are left to the
+single-stream path of the caller.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import http_client
+from retry import retry_call
+from verify import IntegrityError
+
+# Chunk size of the streamed ranges
+CHUNK_SIZE = 1024 * 1024
+
+# Files smaller than this are downloaded over a single stream
+MIN_SIZE = 16 * 1024 * 1024
+
+# Progress of the ranges is saved every SAVE_EVERY bytes (per range)
+SAVE_EVERY = 8 * 1024 * 1024
+
+
+class RangeState:
+    def __init__(self, path, url, size, validator, n_ranges):
+        """
+        Progress of the ranges of a download, loaded from path if it matches the remote file.
+        @param path: The path of the state file.
+        @param url: The url of the file.
+        @param size: The size of the remote file.
+        @param validator: The ETag (or Last-Modified date) of the remote file, if any.
+        @param n_ranges: The number of ranges of a new download.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        state = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    state = json.load(f)
+            except json.JSONDecodeError:
+                pass
+        if state and state["url"] == url and state["size"] == size \
+                and state.get("validator") == validator:
+            self.state = state
+            self.resumed = True
+        else:
+            bounds = [size * i // n_ranges for i in range(n_ranges + 1)]
+            self.state = {
+                "url": url, "size": size, "validator": validator,
+                # [start, end (exclusive), bytes done]
+                "ranges": [[bounds[i], bounds[i + 1], 0] for i in range(n_ranges)],
+            }
+            self.resumed = False
+
+    @property
+    def ranges(self):
+        return self.state["ranges"]
+
+    def advance(self, index, done):
+        with self._lock:
+            self.ranges[index][2] = done
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+
+
+def _validator(res):
+    return res.headers.get("ETag") or res.headers.get("Last-Modified")
+
+
+def probe(url):
+    """
+    @return: A tuple (size, validator) of a remote file, where the validator is its ETag (or its
+    Last-Modified date), size is None if the server does not support range requests or does not
+    announce the size.
+    """
+    try:
+        res = http_client.head(url)
+    except requests.RequestException:
+        res = None
+    if res is not None and res.ok and res.headers.get("Accept-Ranges", "").lower() == "bytes" \
+            and res.headers.get("Content-Length") is not None:
+        return int(res.headers["Content-Length"]), _validator(res)
+
+    # Some servers reject HEAD requests or do not announce Accept-Ranges
+    return probe_range(url)
+
+
+def probe_range(url):
+    """
+    Probe a remote file by asking for its first byte, which servers that reject HEAD requests
+    answer as well.
+    @return: A tuple (size, validator) as returned by probe.
+    """
+    try:
+        with http_client.get(url, headers={"Range": "bytes=0-0"}, stream=True) as res:
+            # e.g. Content-Range: bytes 0-0/1234
+            size = res.headers.get("Content-Range", "").rpartition("/")[2]
+            if res.status_code != 206 or not size.isdigit():
+                return None, None
+            return int(size), _validator(res)
+    except requests.RequestException:
+        return None, None
+
+
+def _fetch_range(url, fd, state, index):
+    start, end, done = state.ranges[index]
+    if start + done >= end:
+        return
+    headers = {"Range": f"bytes={start + done}-{end - 1}"}
+    if state.state["validator"]:
+        headers["If-Range"] = state.state["validator"]
+
+    with http_client.get(url, headers=headers, stream=True) as res:
+        res.raise_for_status()
+        if res.status_code != 206:
+            raise IntegrityError(f"{url} changed or ignored the range request")
+        unsaved = 0
+        try:
+            for chunk in res.iter_content(CHUNK_SIZE):
+                # Never write past the range (a misbehaving server would corrupt the next one)
+                chunk = chunk[:end - start - done]
+                os.pwrite(fd, chunk, start + done)
+                done += len(chunk)
+                unsaved += len(chunk)
+                state.advance(index, done)
+                if unsaved >= SAVE_EVERY:
+                    state.save()
+                    unsaved = 0
+        finally:
+            state.save()
+
+    if start + done < end:
+        raise IntegrityError(f"Truncated range {start}-{end - 1} of {url}: {done}/{end - start} bytes")
+
+
+def download(url, path, connections=4, min_size=MIN_SIZE):
+    """
+    Download a file over parallel range requests, resuming the ranges of a previous attempt.
+    @param url: The url of the file.
+    @param path: The path of the downloaded file.
+    @param connections: The number of parallel connections, default is 4.
+    @param min_size: Files smaller than this (in bytes) are not split, default is 16MB.
+    @return: The size of the file, or None if it was not downloaded because the server does not
+    support ranges or the file is too small (the caller should then use a single stream).
+    @raise requests.RequestException, IntegrityError: If a range keeps failing (the progress is
+    kept for the next attempt).
+    """
+    size, validator = retry_call(probe, url)
+    if size is None or size < min_size:
+        return None
+
+    part_path = path + ".part"
+    state = RangeState(path + ".ranges.json", url, size, validator, connections)
+    if not (state.resumed and os.path.exists(part_path)):
+        # The progress of a state whose part file is gone is void
+        for byte_range in state.ranges:
+            byte_range[2] = 0
+        with open(part_path, "wb") as f:
+            # Reserve the space upfront so that the ranges are written in place
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+        state.save()
+
+    http_client.get_session(pool_size=connections)
+    fd = os.open(part_path, os.O_WRONLY)
+    try:
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            futures = [pool.submit(retry_call, _fetch_range, url, fd, state, index)
+                       for index in range(len(state.ranges))]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+    os.replace(part_path, path)
+    os.remove(state.path)
+    return size
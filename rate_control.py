@@ -0,0 +1,249 @@
+"""
+Adaptive concurrency and bandwidth control of the segment requests.
+
+AdaptiveLimiter bounds the number of in-flight requests to a host and adapts
+the bound (AIMD): it grows while response latency stays close to the best
+latency seen (the server keeps up, so more requests mean more throughput),
+shrinks gently once latency inflates (requests are only queueing), and halves
+on errors or throttling responses (429/503). TokenBucket optionally caps the
+bandwidth used per host.
+"""
+
+import asyncio
+import threading
+import time
+from urllib.parse import urlparse
+import http_client
+
+# Status codes meaning that the server asks us to slow down
+THROTTLE_STATUS = (429, 503)
+
+
+class AdaptiveLimiter:
+    def __init__(self, maximum, minimum=1, initial=None, adaptive=True):
+        """
+        @param maximum: The maximum number of in-flight requests.
+        @param minimum: The minimum number of in-flight requests, default is 1.
+        @param initial: The initial limit, default is half of maximum (maximum if not adaptive).
+        @param adaptive: Whether the limit adapts to the responses, default is True.
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.adaptive = adaptive
+        self.limit = float(initial or (max(minimum, maximum // 2)
+                           if adaptive else maximum))
+        self.inflight = 0
+        self.min_latency = None
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+        # Futures of the coroutines waiting for a slot, with their event loop
+        self._async_waiters = []
+
+    def try_acquire(self):
+        """
+        Take a request slot if one is free (non-blocking).
+        @return: Whether a slot was taken.
+        """
+        with self._cond:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """
+        Wait for a free request slot and take it.
+        """
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    async def acquire_async(self):
+        """
+        Wait for a free request slot and take it, without blocking the event loop. The limiter is
+        shared with other threads, so the waiting coroutines are woken up through their loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.inflight < int(self.limit):
+                    self.inflight += 1
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self._cond:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    @staticmethod
+    def _wake(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def release(self, latency=None, nbytes=0, error=False, throttled=False):
+        """
+        Give back a request slot and feed the outcome of the request to the controller.
+        @param latency: The duration of the request in seconds.
+        @param nbytes: The number of bytes received.
+        @param error: Whether the request failed (timeout, connection error, 5xx).
+        @param throttled: Whether the server asked us to slow down (e.g. 429).
+        """
+        with self._cond:
+            self.inflight -= 1
+            self.requests += 1
+            self.bytes += nbytes
+            self.errors += error
+            self.throttled += throttled
+            if self.adaptive:
+                self._adapt(latency, error or throttled)
+            self._cond.notify_all()
+            for loop, waiter in self._async_waiters:
+                try:
+                    loop.call_soon_threadsafe(self._wake, waiter)
+                except RuntimeError:
+                    # The loop of the waiter is closed
+                    pass
+            self._async_waiters = []
+
+    def _adapt(self, latency, failed):
+        now = time.monotonic()
+        if failed:
+            # Back off at most once per round trip, the other in-flight requests
+            # most likely fail for the same reason
+            if now - self._last_decrease > (self.min_latency or 1):
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+            return
+
+        if latency is None:
+            return
+        # Let the baseline drift up slowly so that it follows the server over long runs
+        self.min_latency = latency if self.min_latency is None else min(
+            latency, self.min_latency * 1.001)
+        if latency > 2 * self.min_latency:
+            self.limit = max(self.minimum, self.limit - 1 / self.limit)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def throughput(self):
+        """
+        @return: The average throughput since creation in bytes/s.
+        """
+        return self.bytes / max(time.monotonic() - self._started, 1e-6)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        """
+        @param rate: The bandwidth cap in bytes/s.
+        @param burst: The bucket capacity in bytes, default is one second of rate.
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes):
+        """
+        Take nbytes tokens, going into debt if needed (non-blocking).
+        @return: The number of seconds to wait before the debt is paid back.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= nbytes
+            return max(0, -self._tokens / self.rate)
+
+    def consume(self, nbytes):
+        """
+        Take nbytes tokens, sleeping until they are available.
+        """
+        time.sleep(self.reserve(nbytes))
+
+
+class RateController:
+    def __init__(self, max_concurrency, adaptive=True, max_rate=None):
+        """
+        Per-host AdaptiveLimiter and (optional) TokenBucket shared by all downloads.
+        @param max_concurrency: The maximum number of in-flight requests per host.
+        @param adaptive: Whether the number of in-flight requests adapts to the responses.
+        @param max_rate: If specified, the bandwidth cap per host in bytes/s.
+        """
+        self.max_concurrency = max_concurrency
+        self.adaptive = adaptive
+        self.max_rate = max_rate
+        self._limiters = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveLimiter(
+                    self.max_concurrency, adaptive=self.adaptive)
+            return self._limiters[host]
+
+    def bucket(self, url):
+        """
+        @return: The TokenBucket of the url's host, or None if the bandwidth is not capped.
+        """
+        if not self.max_rate:
+            return None
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.max_rate)
+            return self._buckets[host]
+
+    def get(self, url, **kwargs):
+        """
+        Send a GET request through the shared session under the host's limits.
+        @return: The requests.Response object (with its content read).
+        """
+        limiter = self.limiter(url)
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            res = http_client.get(url, **kwargs)
+            nbytes = len(res.content)
+        except BaseException as e:
+            # An interrupted request says nothing about the server
+            limiter.release(error=isinstance(e, Exception))
+            raise
+        limiter.release(
+            time.monotonic() - start, nbytes,
+            error=res.status_code >= 500 and res.status_code not in THROTTLE_STATUS,
+            throttled=res.status_code in THROTTLE_STATUS,
+        )
+
+        bucket = self.bucket(url)
+        if bucket:
+            bucket.consume(nbytes)
+
+        return res
+
+    def summary(self):
+        """
+        @return: A printable summary of the state of each host.
+        """
+        with self._lock:
+            limiters = dict(self._limiters)
+        return "\n".join(
+            f"{host}: limit {limiter.limit:.1f}, {limiter.requests} requests, "
+            f"{limiter.errors} errors, {limiter.throttled} throttled, "
+            f"{limiter.throughput()/1024/1024:.2f}MB/s"
+            for host, limiter in limiters.items()
+        )
@@ -0,0 +1,132 @@
+"""
+Per-request retries with jittered exponential backoff.
+
+Transient failures (timeouts, connection resets, 5xx and 429 responses) are
+retried in place instead of failing the whole download. All retries of the
+process draw from a shared RetryBudget, so that a server which is down does
+not turn every request into a burst of retries.
+"""
+
+import asyncio
+import random
+import threading
+import time
+import requests
+
+# Status codes worth retrying
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+
+# Exceptions worth retrying (besides HTTP errors with a status in RETRY_STATUS)
+RETRY_EXCEPTIONS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+
+class RetryBudget:
+    def __init__(self, ratio=0.2, min_retries=100):
+        """
+        Limit the retries to a fraction of the requests.
+        @param ratio: The number of retries allowed per request, default is 0.2.
+        @param min_retries: The number of retries allowed regardless of the ratio, default is 100.
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def spend(self):
+        """
+        Take one retry from the budget.
+        @return: Whether the retry is allowed.
+        """
+        with self._lock:
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+
+_budget = RetryBudget()
+
+
+def get_budget():
+    """
+    @return: The process-wide RetryBudget.
+    """
+    return _budget
+
+
+def is_retryable(exc):
+    """
+    Check whether a failed request is worth retrying.
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None) or getattr(
+        exc, "status", None)
+    if status is not None:
+        return status in RETRY_STATUS
+    return isinstance(exc, RETRY_EXCEPTIONS)
+
+
+def backoff_delay(attempt, exc=None, base_delay=0.5, max_delay=30):
+    """
+    Compute the delay before the next attempt ("full jitter" exponential backoff), honoring
+    the Retry-After header of the failed response if any.
+    @param attempt: The index of the failed attempt, starting from 0.
+    @param exc: The exception raised by the failed attempt.
+    @return: The delay in seconds.
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    response = getattr(exc, "response", None)
+    retry_after = getattr(response, "headers", {}).get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(max_delay, int(retry_after)))
+    return delay
+
+
+def retry_call(func, *args, attempts=5, base_delay=0.5, max_delay=30, budget=None,
+               retryable=is_retryable, **kwargs):
+    """
+    Call func(*args, **kwargs), retrying transient failures.
+    @param attempts: The maximum number of attempts, default is 5.
+    @param base_delay: The backoff delay of the first retry in seconds, doubled at each retry.
+    @param max_delay: The maximum backoff delay in seconds.
+    @param budget: The RetryBudget to draw retries from, default is the process-wide one.
+    @param retryable: Predicate telling whether an exception is transient.
+    @return: The return value of func.
+    """
+    budget = budget or _budget
+    budget.record_request()
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except Exception as exc:
+            if attempt == attempts - 1 or not retryable(exc) or not budget.spend():
+                raise
+            time.sleep(backoff_delay(attempt, exc, base_delay, max_delay))
+
+
+async def retry_async(func, *args, attempts=5, base_delay=0.5, max_delay=30, budget=None,
+                      retryable=is_retryable, **kwargs):
+    """
+    Coroutine version of retry_call, func must be a coroutine function.
+    """
+    budget = budget or _budget
+    budget.record_request()
+    for attempt in range(attempts):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as exc:
+            if attempt == attempts - 1 or not retryable(exc) or not budget.spend():
+                raise
+            await asyncio.sleep(backoff_delay(attempt, exc, base_delay, max_delay))
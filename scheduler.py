@@ -0,0 +1,70 @@
+"""
+Cross-meeting download scheduler.
+
+Runs several videos at once while all their segment requests share one
+global thread pool (the concurrency budget), so that the playlist loading
+and merging of one video overlap with the segment downloads of the others.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import http_client
+
+ORDERS = ["session", "shortest"]
+
+
+def video_duration(link):
+    """
+    Get the duration of a video from its playlist.
+    @param link: The playlist.m3u8 link of the video.
+    @return: The total duration of the segments of its first chunklist in seconds,
+    or infinity if the playlist cannot be loaded.
+    """
+    try:
+        playlist = http_client.load_m3u8(link)
+        if playlist.playlists:
+            playlist = http_client.load_m3u8(playlist.playlists[0].absolute_uri)
+    except Exception:
+        return float("inf")
+
+    return sum(seg.duration or 0 for seg in playlist.segments)
+
+
+def order_jobs(jobs, order="session", mthread=8):
+    """
+    Order the video jobs.
+    @param jobs: The list of jobs, each a dictionary with at least the key "link".
+    @param order: "session" keeps the order of the playlists metadata (i.e. by session),
+    "shortest" downloads the shortest videos first to maximize the completed videos per hour.
+    @param mthread: The number of threads used to probe the video durations.
+    @return: The ordered list of jobs.
+    """
+    assert order in ORDERS
+
+    if order == "session" or not jobs:
+        return list(jobs)
+
+    with ThreadPoolExecutor(max_workers=mthread) as pool:
+        durations = list(pool.map(video_duration, [job["link"] for job in jobs]))
+
+    return [job for _, job in sorted(zip(durations, jobs), key=lambda pair: pair[0])]
+
+
+def run_jobs(jobs, download_video, mthread=16, max_videos=4):
+    """
+    Download several videos concurrently under a global segment concurrency budget.
+    @param jobs: The list of jobs, in the order they should be started.
+    @param download_video: Function download_video(job, pool) downloading a single video,
+    which must submit its segment requests to the shared ThreadPoolExecutor pool.
+    @param mthread: The global number of threads for segment requests, default is 16.
+    @param max_videos: The number of videos downloaded at once, default is 4.
+    """
+    with ThreadPoolExecutor(max_workers=mthread) as segment_pool, \
+            ThreadPoolExecutor(max_workers=max_videos) as video_pool:
+        futures = [video_pool.submit(download_video, job, segment_pool)
+                   for job in jobs]
+
+        # For exception passing
+        results = wait(futures)
+        for result in results.done:
+            if result.exception() is not None:
+                raise result.exception()
@@ -0,0 +1,99 @@
+"""
+Per-video segment manifest used to resume interrupted downloads.
+
+Every completed segment is appended as a json line {"name": ..., "size": ...}
+to video/<mid>/<lang>/tmp/manifest.jsonl, so that a restarted download only
+fetches the segments that are missing or truncated. Segments are named after
+their position in the chunklist rather than their uri, which carries a
+per-session token (media_w<session>_<n>.ts) that changes between runs.
+"""
+
+import json
+import os
+import threading
+
+
+def segment_name(chunklist, index):
+    """
+    @param chunklist: The position of the chunklist among the downloaded ones.
+    @param index: The position of the segment in its chunklist.
+    @return: The name of the segment in the manifest and in the tmp directory, e.g. 0_13.ts.
+    """
+    return f"{chunklist}_{index}.ts"
+
+
+class SegmentManifest:
+    def __init__(self, path):
+        """
+        @param path: The path of the manifest file, existing records are loaded from it.
+        """
+        self.path = path
+        self.sizes = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Partially written line of an interrupted run
+                        continue
+                    if "name" in record:
+                        # Records keyed by uri (older runs) cannot be matched to a segment
+                        self.sizes[record["name"]] = record["size"]
+
+        self._file = open(path, "a")
+
+    def record(self, name, size):
+        """
+        Mark a segment as complete (thread-safe).
+        @param name: The name of the segment, see segment_name.
+        @param size: The number of bytes of the segment.
+        """
+        with self._lock:
+            self.sizes[name] = size
+            self._file.write(json.dumps({"name": name, "size": size}) + "\n")
+            self._file.flush()
+
+    def is_complete(self, name, fname=None):
+        """
+        Check whether a segment was completely downloaded.
+        @param name: The name of the segment, see segment_name.
+        @param fname: If specified, the size of this file must match the recorded size.
+        """
+        if name not in self.sizes:
+            return False
+        if fname is not None:
+            return os.path.exists(fname) and os.path.getsize(fname) == self.sizes[name]
+        return True
+
+    def completed_prefix(self, names):
+        """
+        Find the longest run of complete segments at the start of a chunklist, i.e. the part of
+        a streamed video that can be kept.
+        @param names: The names of the segments of the chunklist, in playlist order.
+        @return: A tuple (number of segments, number of bytes).
+        """
+        count, size = 0, 0
+        for name in names:
+            if not self.is_complete(name):
+                break
+            count += 1
+            size += self.sizes[name]
+        return count, size
+
+    def close(self, remove=False):
+        """
+        Close the manifest.
+        @param remove: Whether the manifest file will be deleted, default is False.
+        """
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
@@ -0,0 +1,157 @@
+"""
+Ordered streaming writer that appends downloaded segments to the final video.
+
+Segments complete out of order when they are downloaded concurrently. The
+writer appends every segment to the output file as soon as all the segments
+before it are written, and keeps the out-of-order ones in memory until then.
+Once the in-memory window exceeds its cap, further out-of-order segments are
+spilled to the tmp directory and read back when their turn comes, so writers
+never block each other.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+
+# Buffer size of the user-space copy fallback
+COPY_BUFSIZE = 1024 * 1024
+
+
+def copy_into(src_path, fw, sha256=None):
+    """
+    Append the content of a file to an open (binary) file object, using kernel-side copies
+    (copy_file_range, or sendfile) when available and a fixed-size buffer otherwise, so that
+    memory usage does not depend on the file size.
+    @param src_path: The path of the file to copy.
+    @param fw: The destination file object.
+    @param sha256: Optional hash object updated with the content of the file, so that the
+    destination does not have to be read back to get its checksum.
+    @return: The number of bytes copied.
+    """
+    fw.flush()
+    size = os.path.getsize(src_path)
+    copied = 0
+    with open(src_path, "rb") as fr:
+        if sha256 is not None:
+            # The source was just written, it is read from the page cache
+            for chunk in iter(lambda: fr.read(COPY_BUFSIZE), b""):
+                sha256.update(chunk)
+            fr.seek(0)
+        try:
+            while copied < size:
+                if hasattr(os, "copy_file_range"):
+                    n = os.copy_file_range(
+                        fr.fileno(), fw.fileno(), size - copied, copied)
+                else:
+                    n = os.sendfile(
+                        fw.fileno(), fr.fileno(), copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            # Kernel-side copies are not supported for these files
+            fr.seek(copied)
+            shutil.copyfileobj(fr, fw, COPY_BUFSIZE)
+            return size
+
+    # Keep the file object's position in sync with the kernel-side writes
+    fw.seek(0, os.SEEK_END)
+    return copied
+
+
+class OrderedSegmentWriter:
+    def __init__(self, write_path, tmp_path, max_buffer=256 * 1024 * 1024,
+                 start=0, offset=0, on_append=None):
+        """
+        @param write_path: The path of the output video file.
+        @param tmp_path: The directory used to spill out-of-order segments once the buffer is full.
+        @param max_buffer: The maximum number of bytes held in memory, default is 256MB.
+        @param start: The index of the first segment to write, used to resume a partial file.
+        @param offset: The number of bytes of the first start segments already in the file; the
+        file is truncated to this size. It is truncated to zero if start is 0.
+        @param on_append: Optional callback on_append(index, size) invoked once a segment is
+        appended to the file.
+        """
+        self.write_path = write_path
+        self.tmp_path = tmp_path
+        self.max_buffer = max_buffer
+        self.on_append = on_append
+        self.size = 0
+        self.count = 0
+        self.sha256 = hashlib.sha256()
+
+        if start > 0:
+            self._file = open(write_path, "r+b")
+            self._file.truncate(offset)
+            # The checksum covers the kept part of the file as well
+            for chunk in iter(lambda: self._file.read(COPY_BUFSIZE), b""):
+                self.sha256.update(chunk)
+            self._file.seek(offset)
+        else:
+            self._file = open(write_path, "wb")
+        self._lock = threading.Lock()
+        self._next = start
+        self._pending = {}  # index -> bytes or path of the spilled segment
+        self._buffered = 0
+
+    def write(self, index, data):
+        """
+        Hand over the content of the index-th segment of the playlist (thread-safe).
+        """
+        with self._lock:
+            if index != self._next:
+                if self._buffered + len(data) <= self.max_buffer:
+                    self._pending[index] = data
+                    self._buffered += len(data)
+                else:
+                    spill_path = os.path.join(self.tmp_path, f"{index}.spill")
+                    with open(spill_path, "wb") as f:
+                        f.write(data)
+                    self._pending[index] = spill_path
+                return
+
+            self._append(data)
+            while self._next in self._pending:
+                pending = self._pending.pop(self._next)
+                if isinstance(pending, bytes):
+                    self._buffered -= len(pending)
+                    self._append(pending)
+                else:
+                    self._appended(copy_into(pending, self._file, self.sha256))
+                    os.remove(pending)
+
+    def _append(self, data):
+        self._file.write(data)
+        self.sha256.update(data)
+        self._appended(len(data))
+
+    def _appended(self, size):
+        if self.on_append:
+            self.on_append(self._next, size)
+        self.size += size
+        self.count += 1
+        self._next += 1
+
+    def close(self, check=True):
+        """
+        Close the output file.
+        @param check: Whether to check that all segments were handed over, default is True.
+        @raise RuntimeError: If some segments were never handed over.
+        """
+        self._file.close()
+        if self._pending:
+            missing = self._next
+            for pending in self._pending.values():
+                if not isinstance(pending, bytes):
+                    os.remove(pending)
+            self._pending = {}
+            if check:
+                raise RuntimeError(
+                    f"Segment {missing} of {self.write_path} was never written")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(check=exc_type is None)
@@ -0,0 +1,313 @@
+"""
+Spreading a crawl over several nodes sharing a filesystem (e.g. NFS).
+
+Work items (video file names, meeting IDs) are assigned to nodes either
+statically, by a stable hash of the item (shard i of n), or dynamically by
+claiming them: a node creates an exclusive lock file per item on the shared
+storage, refreshes it with a heartbeat while it works on it, and turns it into
+a .done marker once finished. A lock whose heartbeat stopped for lease_ttl
+seconds belongs to a dead node and is taken over by the next node that wants
+the item. Locks record the node holding them, and a node only refreshes or
+releases its own, so a node presumed dead never touches the claim that
+replaced its lock. A claims directory holds the state of one crawl (the .done
+markers are never cleared), use a new one for the next crawl.
+
+SQLite does not lock reliably over network filesystems, so every node records
+its progress in its own store (downloaded.<node>.db) and the stores are merged
+into the main one afterwards (python sharding.py merge).
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import quote
+from config import DATA_DIR
+from progress import legacy_path, open_progress, progress_path
+
+
+def default_node_id():
+    """
+    @return: The hostname, i.e. one node per machine (give the other processes their own node ID).
+    """
+    return socket.gethostname()
+
+
+def shard_of(key, n_shards):
+    """
+    @return: The shard (0 to n_shards - 1) of a key, stable across processes and machines.
+    """
+    return int(hashlib.sha1(key.encode()).hexdigest(), 16) % n_shards
+
+
+def parse_shard(shard):
+    """
+    @param shard: A shard specification "i/n", e.g. "0/4".
+    @return: A tuple (i, n).
+    """
+    index, count = (int(part) for part in shard.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard {shard}")
+    return index, count
+
+
+def in_shard(key, shard):
+    """
+    @param shard: A tuple (i, n), or None for all keys.
+    """
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+
+class LeaseClaims:
+    def __init__(self, claims_dir, node_id=None, lease_ttl=300, heartbeat=60):
+        """
+        @param claims_dir: The shared directory of the lock files, created if it does not exist.
+        @param node_id: The name of this node, default is the hostname.
+        @param lease_ttl: Seconds without heartbeat after which a claim is taken over, default is 300.
+        @param heartbeat: Seconds between two refreshes of the held claims, default is 60.
+        """
+        self.claims_dir = claims_dir
+        self.node_id = node_id or default_node_id()
+        # Tells the locks of this instance apart from the ones of a restarted node with the same name
+        self.token = f"{self.node_id}:{uuid.uuid4().hex}"
+        self.lease_ttl = lease_ttl
+        self.heartbeat = heartbeat
+        self._held = set()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        os.makedirs(claims_dir, exist_ok=True)
+
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.claims_dir, quote(key, safe="") + suffix)
+
+    def is_done(self, key):
+        return os.path.exists(self._path(key, ".done"))
+
+    def _create(self, lock_path):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({"node": self.node_id, "token": self.token, "claimed_at": time.time()}, f)
+        return True
+
+    @staticmethod
+    def _owner(lock_path):
+        """
+        @return: The token of the owner of a lock, None if there is no lock or it is not written yet.
+        """
+        try:
+            with open(lock_path, "r") as f:
+                return json.load(f).get("token")
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _is_stale(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) > self.lease_ttl
+        except FileNotFoundError:
+            return False
+
+    def _owns(self, key):
+        return self._owner(self._path(key, ".lock")) == self.token
+
+    def _take_over(self, lock_path):
+        """
+        Replace the stale lock of a dead node by a lock of this node. Nodes racing for the same
+        stale lock are serialized by an exclusive takeover file, so that a lock created or
+        refreshed in the meantime is never removed.
+        @return: Whether the lock now belongs to this node.
+        """
+        owner = self._owner(lock_path)
+        takeover_path = lock_path + ".takeover"
+        if not self._create(takeover_path):
+            # Another node is taking the lock over, unless it died doing so
+            if self._is_stale(takeover_path):
+                try:
+                    os.remove(takeover_path)
+                except FileNotFoundError:
+                    pass
+            return False
+        try:
+            if not self._is_stale(lock_path) or self._owner(lock_path) != owner:
+                return False
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            return self._create(lock_path)
+        finally:
+            os.remove(takeover_path)
+
+    def claim(self, key):
+        """
+        Try to claim an item, taking over the claim of a dead node.
+        @return: Whether the item is now held by this node (False if it is done or held by a live node).
+        """
+        if self.is_done(key):
+            return False
+        lock_path = self._path(key, ".lock")
+        if not self._create(lock_path):
+            if not self._is_stale(lock_path) or not self._take_over(lock_path):
+                return False
+        with self._lock:
+            self._held.add(key)
+        return True
+
+    def release(self, key, done=True):
+        """
+        Release a held item. A claim that was taken over by another node is left to it.
+        @param done: Mark the item as done for all nodes (otherwise it can be claimed again).
+        """
+        with self._lock:
+            self._held.discard(key)
+        if not self._owns(key):
+            return
+        lock_path = self._path(key, ".lock")
+        try:
+            if done:
+                os.replace(lock_path, self._path(key, ".done"))
+            else:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def claimed(self, key):
+        """
+        Usage: with claims.claimed(key) as ok: if ok: ...
+        The item is marked as done if the block does not raise, and released otherwise.
+        """
+        ok = self.claim(key)
+        try:
+            yield ok
+        except BaseException:
+            if ok:
+                self.release(key, done=False)
+            raise
+        if ok:
+            self.release(key, done=True)
+
+    def refresh(self):
+        """
+        Refresh the locks of the held items, and forget the ones taken over by other nodes (e.g.
+        after this node was suspended for longer than lease_ttl).
+        """
+        with self._lock:
+            held = list(self._held)
+        for key in held:
+            if not self._owns(key):
+                with self._lock:
+                    self._held.discard(key)
+                continue
+            try:
+                os.utime(self._path(key, ".lock"))
+            except FileNotFoundError:
+                pass
+
+    def _beat(self):
+        while not self._closed.wait(self.heartbeat):
+            self.refresh()
+
+    def close(self):
+        """
+        Stop the heartbeat and release the held items (they can be claimed again).
+        """
+        self._closed.set()
+        with self._lock:
+            held = list(self._held)
+        for key in held:
+            self.release(key, done=False)
+
+
+def node_proglog(data_dir, node_id):
+    """
+    @return: The path of the progress store of a node.
+    """
+    return os.path.join(data_dir, "metadata", "global", f"downloaded.{node_id}.db")
+
+
+def node_proglogs(data_dir):
+    return sorted(glob.glob(os.path.join(data_dir, "metadata", "global", "downloaded.*.db")))
+
+
+def read_names(db_path):
+    """
+    @return: The set of downloaded videos of a progress store, opened read-only.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=60)
+    try:
+        return {row[0] for row in conn.execute("SELECT fname FROM downloaded")}
+    except sqlite3.OperationalError:
+        # Store of a node that has not recorded anything yet
+        return set()
+    finally:
+        conn.close()
+
+
+def downloaded_by_main(data_dir, proglog=None):
+    """
+    @param proglog: The path of the main progress store, see open_progress.
+    @return: The set of videos of the main progress store, including a legacy downloaded.json
+    list that was never imported into it (read-only, the nodes do not write the main store).
+    """
+    names = set()
+    db_path = progress_path(data_dir, proglog)
+    if os.path.exists(db_path):
+        names |= read_names(db_path)
+    json_path = legacy_path(data_dir, proglog)
+    if json_path is not None and os.path.exists(json_path):
+        with open(json_path, "r") as f:
+            names |= set(json.load(f))
+    return names
+
+
+def downloaded_by_nodes(data_dir):
+    """
+    @return: The set of videos downloaded by any node (not merged yet).
+    """
+    names = set()
+    for db_path in node_proglogs(data_dir):
+        names |= read_names(db_path)
+    return names
+
+
+def merge_progress(data_dir, proglog=None):
+    """
+    Merge the progress stores of all nodes into the main one.
+    @param proglog: The path of the main progress store, see open_progress.
+    @return: The number of videos recorded in the main store.
+    """
+    names = downloaded_by_nodes(data_dir)
+    with open_progress(data_dir, proglog) as store:
+        store.update(names)
+        return len(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Merge the progress of the nodes of a sharded crawl.')
+    parser.add_argument('command', choices=["merge"])
+    parser.add_argument('--data-dir', type=str, default=DATA_DIR,
+                        help='Data directory shared by the nodes.')
+    parser.add_argument('--proglog', type=str, default=None,
+                        help='Path to the main progress store, see video_crawler.py.')
+    args = parser.parse_args()
+
+    total = merge_progress(args.data_dir, args.proglog)
+    print(f"{total} videos recorded in the main progress store.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# The modules of the project live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FileHandler(SimpleHTTPRequestHandler):
+    """
+    Static file server, optionally rejecting HEAD requests, serving byte ranges (guarded by
+    If-Range, with an ETag or only a Last-Modified date), cutting the first full response in
+    half (truncate) and answering after a delay in seconds.
+    """
+    head = True
+    ranges = False
+    etag = True
+    truncate = False
+    delay = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        if not self.head:
+            self.send_error(405)
+            return
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        time.sleep(self.delay)
+        if not self.ranges:
+            if body:
+                super().do_GET()
+            else:
+                super().do_HEAD()
+            return
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        stat = os.stat(path)
+        etag = f'"{stat.st_size}-{stat.st_mtime_ns}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and if_range is not None and if_range not in (etag, last_modified):
+            match = None
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Last-Modified", last_modified)
+        if self.etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if body and self.truncate and not match:
+            type(self).truncate = False
+            data = data[:len(data) // 2]
+        if body:
+            self.wfile.write(data)
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients closing a response early (e.g. a range request answered with the whole file)
+        pass
+
+
+@pytest.fixture
+def serve_dir():
+    """
+    Serve directories over HTTP on localhost.
+    Usage: base_url = serve_dir(path, head=True, ranges=False, etag=True), see FileHandler.
+    """
+    servers = []
+
+    def serve(directory, **options):
+        handler = type("Handler", (FileHandler,), options)
+        handler = functools.partial(handler, directory=str(directory))
+        server = _Server(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
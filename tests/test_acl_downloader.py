@@ -0,0 +1,97 @@
+"""
+Bulk downloads against a local HTTP server.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("tqdm")
+
+import acl_downloader  # noqa: E402
+
+DATA = os.urandom(100 * 1024)
+
+
+@pytest.fixture
+def served(tmp_path):
+    directory = tmp_path / "served"
+    directory.mkdir()
+    (directory / "paper.pdf").write_bytes(DATA)
+    return directory
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = acl_downloader.DownloadManifest(str(tmp_path / "manifest.jsonl"))
+    yield manifest
+    manifest.close()
+
+
+@pytest.mark.parametrize("ranges", [False, True])
+def test_download_without_head(tmp_path, served, serve_dir, manifest, ranges):
+    url = serve_dir(served, head=False, ranges=ranges) + "/paper.pdf"
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    limiter = acl_downloader.HostLimiter(4)
+    outcome = acl_downloader.download_file(url, str(output_dir), manifest, limiter, connections=4)
+    assert outcome == "downloaded"
+    assert (output_dir / "paper.pdf").read_bytes() == DATA
+    assert manifest.get(url)["status"] == "complete"
+
+
+def test_host_limiter_counts_connections():
+    limiter = acl_downloader.HostLimiter(4)
+    url = "http://example.org/paper.pdf"
+    with limiter(url, 8) as held:
+        assert held == 4
+        assert limiter._in_use["example.org"] == 4
+    with limiter(url, 3), limiter(url) as held:
+        assert held == 1
+        assert limiter._in_use["example.org"] == 4
+    assert limiter._in_use["example.org"] == 0
+
+
+def test_complete_file_without_head(tmp_path, served, serve_dir, manifest):
+    url = serve_dir(served, head=False) + "/paper.pdf"
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    (output_dir / "paper.pdf").write_bytes(DATA)
+    # Neither HEAD nor ranges, and no record: the file is downloaded again
+    assert not acl_downloader.is_complete(url, str(output_dir / "paper.pdf"), manifest)
+    limiter = acl_downloader.HostLimiter(4)
+    assert acl_downloader.download_file(url, str(output_dir), manifest, limiter) == "downloaded"
+    assert (output_dir / "paper.pdf").read_bytes() == DATA
+    # Now recorded as complete
+    assert acl_downloader.download_file(url, str(output_dir), manifest, limiter) == "skipped"
+
+
+def test_complete_file_without_head_with_ranges(tmp_path, served, serve_dir, manifest):
+    url = serve_dir(served, head=False, ranges=True) + "/paper.pdf"
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    (output_dir / "paper.pdf").write_bytes(DATA)
+    limiter = acl_downloader.HostLimiter(4)
+    assert acl_downloader.download_file(url, str(output_dir), manifest, limiter) == "skipped"
+    (output_dir / "paper.pdf").write_bytes(DATA[:10])
+    assert acl_downloader.download_file(url, str(output_dir), manifest, limiter) == "downloaded"
+
+
+def test_failed_download_is_resumed(tmp_path, served, serve_dir, manifest, monkeypatch):
+    url = serve_dir(served, ranges=True, truncate=True) + "/paper.pdf"
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    limiter = acl_downloader.HostLimiter(4)
+
+    # The connection drops halfway and the retries are exhausted
+    monkeypatch.setattr(acl_downloader, "retry_call", lambda func, *args: func(*args))
+    monkeypatch.setattr(acl_downloader, "CHUNK_SIZE", 1024)
+    assert acl_downloader.download_file(url, str(output_dir), manifest, limiter) == "failed"
+    record = manifest.get(url)
+    assert record["status"] == "failed" and record["etag"]
+    assert (output_dir / "paper.pdf.part").stat().st_size == len(DATA) // 2
+
+    # The next run only fetches the missing half
+    assert acl_downloader.download_file(url, str(output_dir), manifest, limiter) == "resumed"
+    assert (output_dir / "paper.pdf").read_bytes() == DATA
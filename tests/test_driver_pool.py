@@ -0,0 +1,59 @@
+"""
+Leasing drivers from the pool, with a fake browser.
+"""
+
+import pytest
+
+for module in ("selenium", "webdriver_manager", "config"):
+    pytest.importorskip(module)
+
+import driver_pool  # noqa: E402
+
+
+class FakeDriver:
+    def __init__(self):
+        self.log = []
+        self.responding = True
+
+    def set_page_load_timeout(self, timeout):
+        pass
+
+    def set_script_timeout(self, timeout):
+        pass
+
+    def get(self, url):
+        self.log.append({"message": url})
+
+    def get_log(self, kind):
+        if not self.responding:
+            raise ConnectionError("browser is gone")
+        log, self.log = self.log, []
+        return log
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(driver_pool, "create_driver", FakeDriver)
+    pool = driver_pool.DriverPool(size=1)
+    yield pool
+    pool.close()
+
+
+def test_returned_driver_has_empty_log(pool):
+    with pool.lease() as driver:
+        driver.get("https://example.com/page")
+
+    with pool.lease() as same:
+        assert same is driver
+        assert driver.log == []
+
+
+def test_unresponsive_driver_is_retired_on_return(pool):
+    with pool.lease() as driver:
+        driver.responding = False
+
+    with pool.lease() as fresh:
+        assert fresh is not driver
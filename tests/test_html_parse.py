@@ -0,0 +1,107 @@
+"""
+Each strainer must keep the subtree its selectors look into.
+"""
+
+import pytest
+
+pytest.importorskip("bs4")
+pytest.importorskip("soupsieve")
+
+import html_parse  # noqa: E402
+
+INDEX_PAGE = """
+<html><body>
+<table border="0"><tr><td>Navigation</td></tr></table>
+<table border="1">
+  <tr>
+    <td valign="top" align="center">
+      <a class="webcast_link" href="http://webcast.legco.gov.hk/public/zh-hk/SearchResult?MeetingID=M16100003">
+        <img title="Webcast 12.10.2016" src="webcast.gif">
+      </a>
+    </td>
+    <td valign="top" align="center">12.10.2016</td>
+    <td valign="top" align="center">
+      <a href="/php/hansard/english/rundown.php?date=2016-10-12">Hansard</a>
+      <a href="/yr16-20/english/counmtg/hansard/cm20161012-translate-e.pdf">PDF</a>
+    </td>
+    <td valign="top" align="center">
+      <a href="/php/hansard/chinese/rundown.php?date=2016-10-12">Hansard</a>
+    </td>
+  </tr>
+</table>
+</body></html>
+"""
+
+AGENDA_PAGE = """
+<html><body>
+<div id="player"></div>
+<div id="agenda_content">
+  <div class="row">
+    <span style="float: left; padding-right: 10px;">
+      <a onclick="seek(convertTimeToNum('00:01:02'))">00:01:02</a>
+    </span>
+    <div class="col-lg-8 col-6 nopadding">Opening</div>
+  </div>
+</div>
+</body></html>
+"""
+
+SCRIPT_PAGE = """
+<html><body>
+<a class="nav" href="/index.htm">Home</a>
+<a class="pdf-links item1" href="//www.legco.gov.hk/yr16-20/english/counmtg/hansard/cm20161012.pdf">PDF</a>
+<a class="pdf-links item2" href="//www.legco.gov.hk/yr16-20/english/counmtg/hansard/cm20161012-2.pdf">PDF</a>
+</body></html>
+"""
+
+VIDEO_PAGE = """
+<html><body>
+<span class="ctrl-group ctrl-onoff-on" data-value="C" id="ctrl-can2">Cantonese</span>
+<span class="ctrl-group" data-value="P" id="ctrl-pu2">Putonghua</span>
+<span class="ctrl-group" data-value="E" id="ctrl-eng2">English</span>
+<span id="other" data-value="X">Other</span>
+</body></html>
+"""
+
+
+def test_index_only():
+    soup = html_parse.parse(INDEX_PAGE, only=html_parse.INDEX_ONLY)
+    table = html_parse.INDEX_TABLE.select_one(soup)
+    assert table is not None
+    row = html_parse.ROW.select(table)[0]
+
+    link = html_parse.WEBCAST_LINK.select_one(row)
+    assert link["href"].endswith("MeetingID=M16100003")
+    assert html_parse.TITLED_IMG.select_one(link)["title"] == "Webcast 12.10.2016"
+
+    cells = html_parse.SCRIPT_CELL.select(row)
+    assert len(cells) == 4
+    assert [a["href"] for a in html_parse.SCRIPT_PAGE_LINK.select(cells[-2])] == [
+        "/php/hansard/english/rundown.php?date=2016-10-12"]
+
+
+def test_agenda_only():
+    soup = html_parse.parse(AGENDA_PAGE, only=html_parse.AGENDA_ONLY)
+    agenda = html_parse.AGENDA.select_one(soup)
+    assert agenda is not None
+    row = html_parse.AGENDA_ROW.select(agenda)[0]
+
+    time_span = html_parse.AGENDA_TIME.select_one(row)
+    assert "00:01:02" in html_parse.ONCLICK_LINK.select_one(time_span)["onclick"]
+    assert html_parse.AGENDA_LABEL.select_one(row).text == "Opening"
+
+
+def test_pdf_links_only():
+    soup = html_parse.parse(SCRIPT_PAGE, only=html_parse.PDF_LINKS_ONLY)
+    # The static check of fetch_soup must find the link
+    assert soup.select_one("a.pdf-links.item1") is not None
+    assert html_parse.PDF_LINK.select_one(soup)["href"].endswith("cm20161012.pdf")
+    assert soup.find("a", {"class": "nav"}) is None
+
+
+def test_lang_ctrl_only():
+    soup = html_parse.parse(VIDEO_PAGE, only=html_parse.LANG_CTRL_ONLY)
+    assert soup.find("span", {"id": "ctrl-can2"})["data-value"] == "C"
+    assert soup.find("span", {"id": "ctrl-pu2"})["data-value"] == "P"
+    assert soup.find("span", {"id": "ctrl-eng2"})["data-value"] == "E"
+    assert soup.find("span", {"id": "other"}) is None
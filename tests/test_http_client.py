@@ -0,0 +1,69 @@
+"""
+Shared session: DNS cache and connection pool resizing.
+"""
+
+import socket
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("m3u8")
+pytest.importorskip("config")
+
+import http_client  # noqa: E402
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    calls = []
+    getaddrinfo = socket.getaddrinfo
+
+    def counting_getaddrinfo(host, *args, **kwargs):
+        calls.append(host)
+        return getaddrinfo(host, *args, **kwargs)
+
+    monkeypatch.setattr(socket, "getaddrinfo", counting_getaddrinfo)
+    return calls
+
+
+def test_dns_cache_ttl(lookups):
+    cache = http_client.DnsCache(ttl=60)
+    assert cache.resolve("localhost", 80) == cache.resolve("localhost", 80)
+    assert lookups == ["localhost"]
+
+    cache = http_client.DnsCache(ttl=0)
+    cache.resolve("localhost", 80)
+    cache.resolve("localhost", 80)
+    assert lookups == ["localhost"] * 3
+
+
+def test_dns_cache_is_bounded(lookups):
+    cache = http_client.DnsCache(max_size=2)
+    for port in (80, 81, 82, 80):
+        cache.resolve("127.0.0.1", port)
+    assert len(cache) == 2
+    # The least recently used entry was evicted
+    assert len(lookups) == 4
+
+
+def test_session_resolves_through_cache(tmp_path, serve_dir, lookups, monkeypatch):
+    (tmp_path / "page.html").write_text("hello")
+    url = serve_dir(tmp_path).replace("127.0.0.1", "localhost") + "/page.html"
+    monkeypatch.setattr(http_client, "_dns_cache", http_client.DnsCache())
+    for _ in range(2):
+        # A new connection every time
+        res = http_client.get(url, headers={"Connection": "close"})
+        assert res.text == "hello"
+    assert lookups.count("localhost") == 1
+    # The resolver of the process is not patched
+    assert socket.getaddrinfo.__name__ == "counting_getaddrinfo"
+
+
+def test_resized_pool_closes_replaced_adapter(monkeypatch):
+    session = http_client.get_session()
+    replaced = session.get_adapter("https://example.org")
+    closed = []
+    monkeypatch.setattr(replaced, "close", lambda: closed.append(True))
+    http_client.get_session(pool_size=http_client._pool_size + 1)
+    assert closed == [True]
+    assert session.get_adapter("https://example.org") is not replaced
@@ -0,0 +1,61 @@
+"""
+Range downloads against a local HTTP server.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+import range_download  # noqa: E402
+
+DATA = os.urandom(100 * 1024)
+
+
+@pytest.fixture
+def served(tmp_path):
+    directory = tmp_path / "served"
+    directory.mkdir()
+    (directory / "paper.pdf").write_bytes(DATA)
+    return directory
+
+
+def test_probe_without_head(served, serve_dir):
+    url = serve_dir(served, head=False, ranges=True) + "/paper.pdf"
+    size, etag = range_download.probe(url)
+    assert size == len(DATA)
+    assert etag is not None
+
+
+def test_probe_without_head_nor_ranges(served, serve_dir):
+    url = serve_dir(served, head=False) + "/paper.pdf"
+    assert range_download.probe(url) == (None, None)
+
+
+def test_download_without_head(tmp_path, served, serve_dir):
+    url = serve_dir(served, head=False, ranges=True) + "/paper.pdf"
+    path = tmp_path / "paper.pdf"
+    assert range_download.download(url, str(path), connections=4, min_size=0) == len(DATA)
+    assert path.read_bytes() == DATA
+    assert not os.path.exists(str(path) + ".ranges.json")
+
+
+def test_if_range_falls_back_to_last_modified(tmp_path, served, serve_dir):
+    from verify import IntegrityError
+
+    url = serve_dir(served, ranges=True, etag=False) + "/paper.pdf"
+    size, validator = range_download.probe(url)
+    assert validator is not None
+
+    fd = os.open(str(tmp_path / "paper.pdf.part"), os.O_CREAT | os.O_WRONLY)
+    try:
+        state = range_download.RangeState(str(tmp_path / "current.json"), url, size, validator, 2)
+        range_download._fetch_range(url, fd, state, 0)
+        # Ranges of a previous version of the file must not be mixed with the current one
+        state = range_download.RangeState(
+            str(tmp_path / "changed.json"), url, size, "Thu, 01 Jan 1970 00:00:00 GMT", 2)
+        with pytest.raises(IntegrityError):
+            range_download._fetch_range(url, fd, state, 1)
+    finally:
+        os.close(fd)
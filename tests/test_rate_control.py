@@ -0,0 +1,71 @@
+"""
+Request slots of the adaptive limiter, from threads and coroutines.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("config")
+
+from rate_control import AdaptiveLimiter, RateController  # noqa: E402
+
+
+def test_async_acquire_is_woken_by_release_from_thread():
+    limiter = AdaptiveLimiter(1, adaptive=False)
+    limiter.acquire()
+
+    async def main():
+        waiting = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        threading.Timer(0.05, limiter.release).start()
+        await asyncio.wait_for(waiting, 2)
+
+    asyncio.run(main())
+    assert limiter.inflight == 1
+    assert limiter._async_waiters == []
+
+
+def test_cancelled_async_acquire_takes_no_slot():
+    limiter = AdaptiveLimiter(1, adaptive=False)
+    limiter.acquire()
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire_async(), 0.05)
+
+    asyncio.run(main())
+    assert limiter._async_waiters == []
+    limiter.release()
+    assert limiter.inflight == 0
+
+
+def test_cancelled_segment_request_releases_its_slot(tmp_path, serve_dir):
+    aiohttp = pytest.importorskip("aiohttp")
+    m3u8 = pytest.importorskip("m3u8")
+    pytest.importorskip("tqdm")
+    import async_downloader
+
+    (tmp_path / "media_w1_0.ts").write_bytes(b"\x47" * 188)
+    base_url = serve_dir(tmp_path, delay=1)
+    seg = m3u8.loads("#EXTM3U\n#EXTINF:10.0,\nmedia_w1_0.ts\n", uri=base_url + "/chunklist.m3u8").segments[0]
+    controller = RateController(2, adaptive=False)
+
+    class Progress:
+        def update(self, n):
+            pass
+
+    async def main():
+        async with aiohttp.ClientSession() as session:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(async_downloader._download_segment(
+                    session, asyncio.Semaphore(1), seg, str(tmp_path), 0, None, None, controller,
+                    Progress()), 0.2)
+
+    asyncio.run(main())
+    limiter = controller.limiter(seg.absolute_uri)
+    assert limiter.inflight == 0
+    assert limiter.errors == 0
@@ -0,0 +1,81 @@
+"""
+Lease claims of sharded crawls.
+"""
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("config")
+
+import sharding  # noqa: E402
+
+KEY = "M16100003_can.mp4"
+
+
+@pytest.fixture
+def make_claims(tmp_path):
+    instances = []
+
+    def make(node_id):
+        # The heartbeat thread is never due during a test, refresh() is called explicitly
+        claims = sharding.LeaseClaims(str(tmp_path), node_id=node_id, lease_ttl=60, heartbeat=3600)
+        instances.append(claims)
+        return claims
+
+    yield make
+    for claims in instances:
+        claims.close()
+
+
+def expire(claims, key):
+    old = time.time() - 2 * claims.lease_ttl
+    os.utime(claims._path(key, ".lock"), (old, old))
+
+
+def test_live_claim_is_exclusive(make_claims):
+    a, b = make_claims("a"), make_claims("b")
+    assert a.claim(KEY)
+    assert not b.claim(KEY)
+    a.release(KEY, done=True)
+    assert a.is_done(KEY)
+    assert not b.claim(KEY)
+
+
+def test_stale_claim_is_taken_over(make_claims):
+    a, b = make_claims("a"), make_claims("b")
+    assert a.claim(KEY)
+    expire(a, KEY)
+    assert b.claim(KEY)
+
+    # The node presumed dead neither refreshes nor releases the lock of the new owner
+    expire(b, KEY)
+    a.refresh()
+    assert b._is_stale(b._path(KEY, ".lock"))
+    assert KEY not in a._held
+    a.release(KEY, done=True)
+    assert not a.is_done(KEY)
+    assert b._owns(KEY)
+
+    b.release(KEY, done=True)
+    assert b.is_done(KEY)
+
+
+def test_takeover_in_progress(make_claims):
+    a, b, c = make_claims("a"), make_claims("b"), make_claims("c")
+    assert a.claim(KEY)
+    expire(a, KEY)
+    # b is taking the lock over
+    assert b._create(b._path(KEY, ".lock.takeover"))
+    assert not c.claim(KEY)
+    assert a._owns(KEY)
+
+
+def test_same_node_name_after_restart(make_claims):
+    before, after = make_claims("a"), make_claims("a")
+    assert before.claim(KEY)
+    expire(before, KEY)
+    assert after.claim(KEY)
+    before.release(KEY, done=False)
+    assert after._owns(KEY)
@@ -0,0 +1,78 @@
+"""
+Checksums of merged and streamed videos, and their verification.
+"""
+
+import hashlib
+
+import pytest
+
+for module in ("tqdm", "config"):
+    pytest.importorskip(module)
+
+import segment_writer  # noqa: E402
+from segment_writer import OrderedSegmentWriter  # noqa: E402
+from verify import TS_PACKET_SIZE, TS_SYNC_BYTE, file_checksum, verify_video, \
+    write_checksum  # noqa: E402
+
+SEGMENTS = [(bytes([TS_SYNC_BYTE]) + bytes([i]) * (TS_PACKET_SIZE - 1)) * 4 for i in range(4)]
+
+
+def test_spilled_segments_are_copied_and_hashed(tmp_path, monkeypatch):
+    copied = []
+
+    def copy_into(src_path, fw, sha256=None):
+        copied.append(src_path)
+        return real_copy_into(src_path, fw, sha256)
+
+    real_copy_into = segment_writer.copy_into
+    monkeypatch.setattr(segment_writer, "copy_into", copy_into)
+    path = tmp_path / "video.mp4"
+    # Room for a single out-of-order segment, the others are spilled
+    with OrderedSegmentWriter(str(path), str(tmp_path), max_buffer=len(SEGMENTS[0])) as writer:
+        for index in (3, 2, 1, 0):
+            writer.write(index, SEGMENTS[index])
+
+    assert path.read_bytes() == b"".join(SEGMENTS)
+    assert len(copied) == 2
+    assert not list(tmp_path.glob("*.spill"))
+    assert writer.sha256.hexdigest() == hashlib.sha256(b"".join(SEGMENTS)).hexdigest()
+
+
+def test_merge_hashes_while_copying(tmp_path, monkeypatch):
+    pytest.importorskip("m3u8")
+    pytest.importorskip("utils")
+    import video_crawler
+
+    tmp = tmp_path / "tmp"
+    tmp.mkdir()
+    for index, data in enumerate(SEGMENTS):
+        (tmp / f"0_{index}.ts").write_bytes(data)
+    monkeypatch.setattr(video_crawler, "file_checksum", None, raising=False)
+
+    video_crawler.merge_ts("video.mp4", str(tmp_path))
+
+    path = tmp_path / "video.mp4"
+    assert path.read_bytes() == b"".join(SEGMENTS)
+    assert verify_video(str(path))[1] == []
+
+
+@pytest.mark.parametrize("data", [
+    b"ID3\x04\x00\x00\x00\x00\x00\x00" + b"\xff\xf1\x50\x80" * 100,
+    b"\xff\xf1\x50\x80" * 100,
+], ids=["id3", "adts"])
+def test_audio_only_output_is_valid(tmp_path, data):
+    path = tmp_path / "audio.mp4"
+    path.write_bytes(data)
+    write_checksum(str(path), file_checksum(str(path)))
+
+    assert verify_video(str(path))[1] == []
+
+    path.write_bytes(data[:-1])
+    assert verify_video(str(path))[1] == ["checksum mismatch"]
+
+
+def test_broken_ts_output_is_reported(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"".join(SEGMENTS)[1:])
+
+    assert verify_video(str(path))[1] == ["not a MPEG-TS stream near byte 0"]
@@ -0,0 +1,213 @@
+"""
+Resuming a streamed download from a tmp directory left by an interrupted run.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+for module in ("requests", "m3u8", "tqdm", "config", "utils"):
+    pytest.importorskip(module)
+
+import video_crawler  # noqa: E402
+from segment_manifest import SegmentManifest, segment_name  # noqa: E402
+from verify import TS_PACKET_SIZE, TS_SYNC_BYTE, read_checksum, file_checksum  # noqa: E402
+
+MID = "M16100003"
+
+
+def ts_segment(value, n_packets=4):
+    return (bytes([TS_SYNC_BYTE]) + bytes([value]) * (TS_PACKET_SIZE - 1)) * n_packets
+
+
+SEGMENTS = [ts_segment(i) for i in range(3)]
+
+
+def publish(served, token, present=range(len(SEGMENTS))):
+    """
+    Serve the chunklist of a new session, whose segment names carry the session token.
+    @param present: The positions of the segments the server has.
+    """
+    for path in served.glob("*.ts"):
+        path.unlink()
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:10"]
+    for i, data in enumerate(SEGMENTS):
+        if i in present:
+            (served / f"media_w{token}_{i}.ts").write_bytes(data)
+        lines += ["#EXTINF:10.0,", f"media_w{token}_{i}.ts"]
+    lines.append("#EXT-X-ENDLIST")
+    (served / "playlist.m3u8").write_text("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def served(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    publish(served, 1)
+    return served
+
+
+@pytest.fixture
+def playlist(served, serve_dir, monkeypatch):
+    monkeypatch.setattr(video_crawler, "read_video_dates", lambda data_dir: {MID: "2016-10-12"})
+    return serve_dir(served) + "/playlist.m3u8", b"".join(SEGMENTS)
+
+
+@pytest.mark.parametrize("leftover", ["media_w1_0.ts", "1.spill"])
+def test_stream_resumes_from_non_empty_tmp(tmp_path, playlist, leftover):
+    link, expected = playlist
+    data_dir = tmp_path / "data"
+    download_path = data_dir / "video" / MID / "can"
+    (download_path / "tmp").mkdir(parents=True)
+    # Left by an interrupted non-streamed run, or spilled by a killed streamed run
+    (download_path / "tmp" / leftover).write_bytes(b"stale")
+
+    video_crawler.download_from_playlist_m3u8(
+        link, MID, str(data_dir), lang="can", mthread=2, log_progress=False, stream=True)
+
+    video = download_path / f"{MID}_can.mp4"
+    assert video.read_bytes() == expected
+    assert read_checksum(str(video)) == file_checksum(str(video))
+    assert not (download_path / "tmp").exists()
+
+
+def test_resume_after_session_change(tmp_path, served, playlist):
+    link, expected = playlist
+    data_dir = tmp_path / "data"
+    tmp = data_dir / "video" / MID / "can" / "tmp"
+    # Stored but not merged
+    video_crawler.download_from_playlist_m3u8(
+        link, MID, str(data_dir), lang="can", mthread=2, merge=False, log_progress=False)
+    (tmp / "media_w1_0.ts").write_bytes(b"stale")
+
+    # The next session has other segment names, the stored segments are not requested again
+    publish(served, 2, present=[])
+    video_crawler.download_from_playlist_m3u8(
+        link, MID, str(data_dir), lang="can", mthread=2, stream=False, log_progress=False)
+    assert (tmp.parent / f"{MID}_can.mp4").read_bytes() == expected
+    assert not tmp.exists()
+
+
+def test_stream_resume_after_session_change(tmp_path, served, playlist):
+    link, expected = playlist
+    data_dir = tmp_path / "data"
+    # Interrupted after the first two segments
+    publish(served, 1, present=[0, 1])
+    with pytest.raises(Exception):
+        video_crawler.download_from_playlist_m3u8(
+            link, MID, str(data_dir), lang="can", mthread=1, log_progress=False)
+
+    publish(served, 2, present=[2])
+    video_crawler.download_from_playlist_m3u8(
+        link, MID, str(data_dir), lang="can", mthread=2, log_progress=False)
+    assert (data_dir / "video" / MID / "can" / f"{MID}_can.mp4").read_bytes() == expected
+
+
+def test_manifest_closed_on_failure(tmp_path, served, playlist, monkeypatch):
+    link, _ = playlist
+    manifests = []
+
+    class Manifest(SegmentManifest):
+        def __init__(self, path):
+            super().__init__(path)
+            manifests.append(self)
+
+    monkeypatch.setattr(video_crawler, "SegmentManifest", Manifest)
+    publish(served, 1, present=[0])
+    with pytest.raises(Exception):
+        video_crawler.download_from_playlist_m3u8(
+            link, MID, str(tmp_path / "data"), lang="can", mthread=2, log_progress=False)
+    assert manifests and manifests[0]._file.closed
+
+
+def test_failed_video_cancels_its_segments_on_shared_pool(tmp_path, playlist, monkeypatch):
+    link, _ = playlist
+    fetched = []
+
+    def download_segment(seg, tmp_path, index, writer, *args):
+        if index == 0:
+            raise ConnectionError("segment 0 failed")
+        time.sleep(0.2)
+        fetched.append((index, writer._file.closed))
+
+    monkeypatch.setattr(video_crawler, "download_segment", download_segment)
+    pool = ThreadPoolExecutor(max_workers=2)
+    with pytest.raises(ConnectionError):
+        video_crawler.download_from_playlist_m3u8(
+            link, MID, str(tmp_path / "data"), lang="can", log_progress=False, pool=pool)
+    pool.shutdown(wait=True)
+    # The segments already running finished before the writer was closed
+    assert fetched and all(not closed for _, closed in fetched)
+
+
+@pytest.mark.parametrize("video", [None, b"", SEGMENTS[0], b"".join(SEGMENTS) + b"junk"],
+                         ids=["deleted", "empty", "truncated", "longer"])
+def test_streamed_video_lost_after_manifest(tmp_path, playlist, video):
+    link, expected = playlist
+    data_dir = tmp_path / "data"
+    download_path = data_dir / "video" / MID / "can"
+    (download_path / "tmp").mkdir(parents=True)
+    # All segments recorded, but the video was changed since
+    manifest = SegmentManifest(str(download_path / "tmp" / "manifest.jsonl"))
+    for i, data in enumerate(SEGMENTS):
+        manifest.record(segment_name(0, i), len(data))
+    manifest.close()
+    if video is not None:
+        (download_path / f"{MID}_can.mp4").write_bytes(video)
+
+    video_crawler.download_from_playlist_m3u8(
+        link, MID, str(data_dir), lang="can", mthread=2, log_progress=False)
+    assert (download_path / f"{MID}_can.mp4").read_bytes() == expected
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_all_variants_are_kept(tmp_path, served, playlist, stream):
+    link, _ = playlist
+    renditions = []
+    for i, bandwidth in enumerate([200000, 800000]):
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:10"]
+        for j in range(2):
+            data = ts_segment(10 * i + j)
+            (served / f"v{i}_{j}.ts").write_bytes(data)
+            lines += ["#EXTINF:10.0,", f"v{i}_{j}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        (served / f"chunklist_{i}.m3u8").write_text("\n".join(lines) + "\n")
+        renditions.append(ts_segment(10 * i) + ts_segment(10 * i + 1))
+    (served / "master.m3u8").write_text(
+        "#EXTM3U\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=200000\nchunklist_0.m3u8\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=800000\nchunklist_1.m3u8\n")
+
+    data_dir = tmp_path / "data"
+    video_crawler.download_from_playlist_m3u8(
+        link.replace("playlist.m3u8", "master.m3u8"), MID, str(data_dir), lang="can", mthread=2,
+        log_progress=False, stream=stream, variant="all")
+    download_path = data_dir / "video" / MID / "can"
+    for i, expected in enumerate(renditions):
+        video = download_path / f"{MID}_can_{i}.mp4"
+        assert video.read_bytes() == expected
+        assert read_checksum(str(video)) == file_checksum(str(video))
+    assert not (download_path / "tmp").exists()
+
+
+@pytest.mark.parametrize("sharded", [{"shard": (0, 1)}, {"claims_dir": "claims"}])
+def test_sharded_run_skips_legacy_json(tmp_path, monkeypatch, sharded):
+    global_dir = tmp_path / "metadata" / "global"
+    global_dir.mkdir(parents=True)
+    link = "https://example.org/playlist.m3u8"
+    (global_dir / "playlists.json").write_text(json.dumps(
+        {"1617": {MID: {"can": link}, "M16100004": {"can": link}}}))
+    # Progress of an install that predates the SQLite store
+    (global_dir / "downloaded.json").write_text(json.dumps([f"{MID}_can.mp4"]))
+
+    downloaded = []
+    monkeypatch.setattr(video_crawler, "download_from_playlist_m3u8",
+                        lambda **kwargs: downloaded.append(kwargs["mid"]))
+    if "claims_dir" in sharded:
+        sharded = {"claims_dir": str(tmp_path / sharded["claims_dir"])}
+    failures = video_crawler.download_meetings(
+        str(tmp_path), proglog=str(global_dir / "downloaded.json"), node_id="node0", **sharded)
+    assert failures == {}
+    assert downloaded == ["M16100004"]
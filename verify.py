@@ -0,0 +1,167 @@
+"""
+Integrity checks of downloaded segments and merged videos.
+
+Segments are checked against their Content-Length and the MPEG-TS packet
+structure (a 0x47 sync byte every 188 bytes) as soon as they are downloaded.
+Audio-only renditions are packed audio (ADTS frames behind an ID3 tag) and
+only get the checksum check.
+Merged videos get a sha256 checksum file (sha256sum format) next to them, and
+a whole video/ tree can be re-verified in parallel across cores.
+"""
+
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+from tqdm import tqdm
+from config import DATA_DIR
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+# Read size of the streaming checks, a multiple of the packet size
+READ_SIZE = TS_PACKET_SIZE * 8192
+
+
+class IntegrityError(ConnectionError):
+    """
+    Raised when a downloaded body is truncated or is not a MPEG-TS stream.
+    """
+
+
+def is_ts(data):
+    """
+    Check that data is a sequence of whole MPEG-TS packets.
+    """
+    n_packets, remainder = divmod(len(data), TS_PACKET_SIZE)
+    return remainder == 0 and n_packets > 0 \
+        and data[::TS_PACKET_SIZE] == bytes([TS_SYNC_BYTE]) * n_packets
+
+
+def is_packed_audio(data):
+    """
+    Check whether data starts like a packed audio stream (an ID3 tag or an ADTS frame), the
+    format of audio-only renditions, which have no MPEG-TS packets.
+    """
+    return data[:3] == b"ID3" or (len(data) >= 2 and data[0] == 0xFF and data[1] & 0xF6 == 0xF0)
+
+
+def check_segment(data, content_length=None, uri=""):
+    """
+    Check a downloaded segment.
+    @param data: The body of the segment.
+    @param content_length: The Content-Length header of the response, if any.
+    @param uri: The uri of the segment, the packet structure is only checked for .ts segments.
+    @raise IntegrityError: If the body is truncated or is not MPEG-TS.
+    """
+    if content_length is not None and int(content_length) != len(data):
+        raise IntegrityError(
+            f"Truncated segment {uri}: {len(data)}/{content_length} bytes")
+    if urlparse(uri).path.endswith(".ts") and not is_ts(data):
+        raise IntegrityError(f"Segment {uri} is not a MPEG-TS stream")
+
+
+def checksum_path(path):
+    return path + ".sha256"
+
+
+def write_checksum(path, digest):
+    """
+    Store the sha256 digest of a file in path.sha256 (sha256sum format).
+    """
+    with open(checksum_path(path), "w") as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n")
+
+
+def read_checksum(path):
+    """
+    @return: The stored sha256 digest of a file, or None if there is none.
+    """
+    if not os.path.exists(checksum_path(path)):
+        return None
+    with open(checksum_path(path), "r") as f:
+        return f.read().split()[0]
+
+
+def file_checksum(path):
+    """
+    @return: The sha256 digest of a file, read with a fixed-size buffer.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def verify_video(path):
+    """
+    Verify a merged video: MPEG-TS packet structure (except for audio-only outputs) and stored
+    checksum (if any).
+    @param path: The path of the video.
+    @return: A tuple (path, list of problems), the list is empty if the video is fine.
+    """
+    problems = []
+    sha256 = hashlib.sha256()
+    offset = 0
+    sync_ok = True
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            sha256.update(chunk)
+            if offset == 0 and is_packed_audio(chunk):
+                # Audio-only rendition, there is no packet structure to check
+                sync_ok = False
+            if sync_ok and not is_ts(chunk):
+                problems.append(f"not a MPEG-TS stream near byte {offset}")
+                sync_ok = False
+            offset += len(chunk)
+
+    if offset == 0:
+        problems.append("empty file")
+
+    expected = read_checksum(path)
+    if expected is not None and expected != sha256.hexdigest():
+        problems.append("checksum mismatch")
+
+    return path, problems
+
+
+def verify_tree(data_dir, mthread=None):
+    """
+    Verify all merged videos of data_dir/video in parallel.
+    @param data_dir: The data directory.
+    @param mthread: The number of processes, default is the number of cores.
+    @return: A dictionary {path: problems} of the broken videos.
+    """
+    paths = []
+    for root, _, fnames in os.walk(os.path.join(data_dir, "video")):
+        paths.extend(os.path.join(root, fname)
+                     for fname in fnames if fname.endswith(".mp4"))
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=mthread) as pool:
+        for path, problems in tqdm(pool.map(verify_video, paths), total=len(paths)):
+            if problems:
+                results[path] = problems
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Verify downloaded HKLEGCO videos.')
+    parser.add_argument('--data-dir', type=str, default=DATA_DIR,
+                        help='Data directory containing the video/ tree.')
+    parser.add_argument('--mthread', type=int, default=None,
+                        help='Number of processes, default is the number of cores.')
+    args = parser.parse_args()
+
+    broken = verify_tree(args.data_dir, mthread=args.mthread)
+    for path, problems in broken.items():
+        print(f"{path}: {'; '.join(problems)}")
+    print(f"{len(broken)} broken videos.")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,24 @@
 # 2022 Cihan Xiao
 
 from pathlib import Path
-import requests
 import os
-from glob import glob
-import m3u8
+import hashlib
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
 from utils import mkdir_if_not_exist, read_video_dates
+import http_client
+from segment_writer import OrderedSegmentWriter, copy_into
+from segment_manifest import SegmentManifest, segment_name
+from progress import open_progress
+import sharding
+from scheduler import ORDERS, order_jobs, run_jobs
+from rate_control import RateController
+from retry import retry_call
+from verify import check_segment, file_checksum, write_checksum
 import json
 from config import DATA_DIR, MTHREAD
-import time
+import sys
 import datetime
 import argparse
 
@@ -41,46 +49,148 @@ def ts_fname_sort_func(ts_fname):
     return int(ts_fname.strip(".ts").split("_")[-1])
 
 
-def merge_ts(fname, download_path, rm_tmp=True):
+VARIANTS = ["lowest", "highest", "closest", "audio", "all"]
+VIDEO_CODECS = ("avc", "hvc", "hev", "vp0", "av01")
+
+
+def select_variants(playlist, variant="lowest", target_bitrate=None):
+    """
+    Select the rendition(s) of a master playlist to download.
+    @param playlist: The parsed (master) playlist.m3u8.
+    @param variant: The selection policy, "lowest"/"highest" bandwidth, the one "closest" to the
+    target bitrate, "audio" only (falls back to lowest if the playlist has no audio-only rendition),
+    or "all" renditions, default is lowest.
+    @param target_bitrate: The target bitrate in bits/s, required by the "closest" policy.
+    @return: The list of chunklist links.
+    """
+    assert variant in VARIANTS
+    assert variant != "closest" or target_bitrate
+
+    variants = list(playlist.playlists)
+    if variant == "all":
+        return [sublist.absolute_uri for sublist in variants]
+
+    if variant == "audio":
+        for media in playlist.media:
+            if media.type == "AUDIO" and media.uri:
+                return [media.absolute_uri]
+        audio_variants = [
+            sublist for sublist in variants
+            if sublist.stream_info.codecs
+            and not any(codec in sublist.stream_info.codecs for codec in VIDEO_CODECS)
+        ]
+        variants = audio_variants or variants
+        variant = "lowest"
+
+    def bandwidth(sublist):
+        return sublist.stream_info.bandwidth or 0
+
+    if variant == "lowest":
+        selected = min(variants, key=bandwidth)
+    elif variant == "highest":
+        selected = max(variants, key=bandwidth)
+    else:
+        selected = min(variants, key=lambda sublist: abs(
+            bandwidth(sublist) - target_bitrate))
+
+    return [selected.absolute_uri]
+
+
+def merge_ts(fname, download_path, rm_tmp=True, manifest=False, files=None):
+    """
+    Merge the .ts files in download_path/tmp into download_path/fname.
+    @param fname: The name of the merged video.
+    @param download_path: The directory of the video.
+    @param rm_tmp: Whether the tmp directory will be removed after merging, default is True.
+    @param manifest: If True, nothing is copied; an ffmpeg concat manifest listing the .ts
+    files in order is written to download_path/fname.txt instead (and the .ts files are kept).
+    @param files: The paths of the .ts files to merge, in order, default is all the .ts files in
+    download_path/tmp sorted by index. Leftovers of other downloads are removed with the tmp
+    directory.
+    """
     read_path = os.path.join(download_path, "tmp")
     write_path = os.path.join(download_path, fname)
-    files = sorted(glob(os.path.join(read_path, "*.ts")),
-                   key=ts_fname_sort_func)
+    if files is None:
+        with os.scandir(read_path) as entries:
+            files = sorted((entry.path for entry in entries if entry.name.endswith(".ts")),
+                           key=ts_fname_sort_func)
+
+    if manifest:
+        with open(write_path + ".txt", "w") as f:
+            for file in files:
+                f.write(f"file '{os.path.abspath(file)}'\n")
+        print(f"Listed {len(files)} files in {write_path}.txt")
+        return
 
     size = 0
-    # Read from .ts files and write into a single .mp4 file
+    sha256 = hashlib.sha256()
+    # Copy the .ts files into a single .mp4 file, hashing them on the way
     with open(write_path, "wb") as fw:
         for file in files:
-            with open(file, "rb") as fr:
-                data = fr.read()
-                fw.write(data)
-                size += len(data)
+            size += copy_into(file, fw, sha256)
             if rm_tmp:
                 os.remove(file)
     if rm_tmp:
+        clear_tmp(read_path)
         os.rmdir(read_path)
+    write_checksum(write_path, sha256.hexdigest())
 
     print(f"Merged {len(files)} files with total size {size/1024/1024:.2f}MB")
 
 
-def download_segment(seg, tmp_path):
+def download_segment(seg, tmp_path, index=None, writer=None, manifest=None, controller=None,
+                     name=None):
     """
     Download a single video segment (.ts) to the directory specified by tmp_path.
+    @param index: The position of the segment in its chunklist, required by writer.
+    @param writer: If specified, the segment is handed to this OrderedSegmentWriter
+    instead of being stored as a tmp file.
+    @param manifest: If specified, the stored .ts file is recorded in this SegmentManifest.
+    @param controller: If specified, the request is sent under the limits of this RateController.
+    @param name: The name of the tmp file and manifest record (see segment_manifest.segment_name),
+    default is the uri of the segment.
     """
-    fname = os.path.join(tmp_path, seg.uri)
+    def fetch():
+        if controller:
+            res = controller.get(seg.absolute_uri)
+        else:
+            res = http_client.get(seg.absolute_uri)
+        res.raise_for_status()
+        check_segment(res.content, res.headers.get("Content-Length")
+                      if "Content-Encoding" not in res.headers else None, seg.absolute_uri)
+        return res.content
 
-    res = requests.get(seg.absolute_uri)
-    data = res.content
+    # Transient failures (including truncated bodies) are retried with backoff
+    data = retry_call(fetch)
 
-    with open(fname, "wb") as f:
-        f.write(data)
+    if writer:
+        writer.write(index, data)
+    else:
+        name = name or seg.uri
+        with open(os.path.join(tmp_path, name), "wb") as f:
+            f.write(data)
+        if manifest:
+            manifest.record(name, len(data))
 
     return len(data)
 
 
+def clear_tmp(tmp_path, keep=None):
+    """
+    Remove the files left in the tmp directory by interrupted runs (.ts files of a non-streamed
+    download, spilled segments), which a streamed download does not use.
+    @param tmp_path: The tmp directory of a video.
+    @param keep: The path of a file to keep (the segment manifest).
+    """
+    for entry in os.scandir(tmp_path):
+        if entry.is_file() and entry.path != keep:
+            os.remove(entry.path)
+
+
 def download_from_playlist_m3u8(
     link, mid, data_dir, lang="can", mthread=10, merge=True, log_progress=True,
-    proglog=None,
+    proglog=None, engine="thread", stream=True, pool=None, variant="lowest", target_bitrate=None,
+    controller=None,
 ):
     """
     Download a video using the provided playlist.m3u8 link.
@@ -91,8 +201,21 @@ def download_from_playlist_m3u8(
     @param mthread: The number of thread used for downloading, default is 10.
     @param merge: Whether the downloaded .ts files will be merged into a full video, default is True.
     @param log_progress: Whether the download progress will be logged, default is True.
+    @param engine: "thread" downloads with a thread pool of mthread workers, "async" downloads
+    on a single event loop with mthread concurrent requests, default is thread.
+    @param stream: Whether the segments are appended to the final video in playlist order as they
+    arrive instead of being stored as tmp files and merged afterwards, default is True. Only takes
+    effect if merge is True.
+    @param pool: If specified, the segments are downloaded on this ThreadPoolExecutor shared with
+    other downloads instead of a pool of mthread threads owned by this video.
+    @param variant: The rendition selection policy (see select_variants), default is lowest. If
+    several renditions are selected ("all"), the i-th one is saved to <mid>_<lang>_<i>.mp4.
+    @param target_bitrate: The target bitrate in bits/s of the "closest" policy.
+    @param controller: If specified, the segment requests are sent under the adaptive concurrency
+    and bandwidth limits of this RateController (shared with other downloads).
     """
-    print(f"Downloading {mid}_{lang} with {mthread} threads...")
+    assert engine in ["thread", "async"]
+    print(f"Downloading {mid}_{lang} with {mthread} {engine} workers...")
 
     # Define the download location
     download_path = os.path.join(data_dir, "video", mid, lang)
@@ -102,62 +225,134 @@ def download_from_playlist_m3u8(
     tmp_path = os.path.join(download_path, "tmp")
     mkdir_if_not_exist(tmp_path)
 
+    # Size the shared keep-alive connection pool to the number of threads
+    http_client.get_session(pool_size=mthread)
+
     # Parse the playlist.m3u8 from the provided link
-    playlist = m3u8.load(link)
-
-    # Extract the chunklist m3u8 link that contains the actual segments
-    sublinks = []
-    for sublist in playlist.playlists:
-        sublinks.append(sublist.absolute_uri)
-
-    # Download all segments from each chunklist
-    for i, sublink in enumerate(sublinks):
-        sublist = m3u8.load(sublink)
-        size = 0
-        # Single thread downloading
-        if mthread == 1:
-            for j, seg in tqdm(enumerate(sublist.segments)):
-                size += download_segment(seg, tmp_path)
-        # Multi-thread downloading
-        elif mthread > 1:
-            with ThreadPoolExecutor(max_workers=mthread) as pool:
-                list(
-                    tqdm(
-                        pool.map(
-                            download_segment,
-                            sublist.segments,
-                            [tmp_path] * len(sublist.segments),
-                        ),
-                        total=len(sublist.segments),
-                    )
-                )
+    playlist = retry_call(http_client.load_m3u8, link)
 
-    fname = "_".join([mid, lang]) + ".mp4"
+    # Extract the chunklist m3u8 link that contains the actual segments, unless the
+    # playlist lists the segments itself
+    if playlist.is_variant:
+        sublinks = select_variants(
+            playlist, variant=variant, target_bitrate=target_bitrate)
+    else:
+        sublinks = [link]
 
-    # Merge the .ts files
+    fname = "_".join([mid, lang]) + ".mp4"
+    # Every rendition gets its own video when several are downloaded
+    fnames = [fname] if len(sublinks) == 1 else [
+        f"{mid}_{lang}_{i}.mp4" for i in range(len(sublinks))]
+    stream = stream and merge
+
+    # Segments completed by an interrupted run are recorded in the manifest
+    with SegmentManifest(os.path.join(tmp_path, "manifest.jsonl")) as manifest:
+        if stream:
+            clear_tmp(tmp_path, keep=manifest.path)
+
+        # Download all segments from each chunklist
+        writer = None
+        files = []
+        for i, sublink in enumerate(sublinks):
+            sublist = retry_call(http_client.load_m3u8, sublink)
+            segments = sublist.segments
+            write_path = os.path.join(download_path, fnames[i])
+            # Named by position, the uris change from one session to the next
+            names = [segment_name(i, j) for j in range(len(segments))]
+            files.append([os.path.join(tmp_path, name) for name in names])
+
+            if stream:
+                # Keep the part of the video that was already streamed
+                start, offset = manifest.completed_prefix(names)
+                if not os.path.exists(write_path) or os.path.getsize(write_path) < offset:
+                    # The video was deleted or truncated since
+                    start, offset = 0, 0
+                elif start == len(segments) and os.path.getsize(write_path) == offset:
+                    # Already fully streamed by an interrupted run
+                    write_checksum(write_path, file_checksum(write_path))
+                    continue
+                indices = list(range(start, len(segments)))
+                writer = OrderedSegmentWriter(
+                    write_path, tmp_path, start=start, offset=offset,
+                    on_append=lambda index, size, names=names: manifest.record(names[index], size),
+                )
+            else:
+                # Only fetch the .ts files that are missing or truncated
+                indices = [
+                    j for j, name in enumerate(names)
+                    if not manifest.is_complete(name, os.path.join(tmp_path, name))
+                ]
+            pending = [segments[j] for j in indices]
+            pending_names = [names[j] for j in indices]
+            if len(pending) < len(segments):
+                print(
+                    f"Resuming chunklist {i} with {len(pending)}/{len(segments)} segments left...")
+
+            with writer if stream else nullcontext():
+                # Download all segments on one event loop
+                if engine == "async":
+                    import async_downloader
+
+                    async_downloader.download_segments(
+                        pending, tmp_path, concurrency=mthread, indices=indices,
+                        writer=writer, manifest=manifest, controller=controller, names=pending_names)
+                # Single thread downloading
+                elif mthread == 1 and not pool:
+                    for j, seg, name in tqdm(zip(indices, pending, pending_names), total=len(pending)):
+                        download_segment(seg, tmp_path, j, writer,
+                                         manifest, controller, name)
+                # Multi-thread downloading, on the shared pool if provided
+                elif mthread > 1 or pool:
+                    with nullcontext(pool) if pool else ThreadPoolExecutor(max_workers=mthread) as segment_pool:
+                        futures = [
+                            segment_pool.submit(download_segment, seg, tmp_path, j, writer,
+                                                manifest, controller, name)
+                            for j, seg, name in zip(indices, pending, pending_names)
+                        ]
+                        try:
+                            for future in tqdm(as_completed(futures), total=len(futures)):
+                                future.result()
+                        except BaseException:
+                            # The queued segments would outlive the video on a shared pool, and the
+                            # running ones must be done before the writer is closed
+                            for future in futures:
+                                future.cancel()
+                            wait(futures)
+                            raise
+
+            if stream:
+                write_checksum(write_path, writer.sha256.hexdigest())
+                print(
+                    f"Streamed {writer.count} files with total size {writer.size/1024/1024:.2f}MB")
+
+    # The manifest is only needed until the video is complete
     if merge:
-        merge_ts(fname, download_path)
+        os.remove(manifest.path)
 
-    # The downloading progress will be stored at data_dir/metadata/global/downloaded.json
+    # Merge the .ts files (already done on the fly if streamed)
+    if stream:
+        try:
+            os.rmdir(tmp_path)
+        except OSError:
+            # Not worth failing a complete video over
+            print(f"Could not remove {tmp_path}")
+    elif merge:
+        for i, chunklist_files in enumerate(files):
+            # The tmp directory is removed with the last rendition
+            merge_ts(fnames[i], download_path, rm_tmp=i == len(files) - 1, files=chunklist_files)
+
+    # The downloading progress will be stored at data_dir/metadata/global/downloaded.db
     if log_progress:
-        downloaded_fname = os.path.join(
-            data_dir, "metadata", "global", "downloaded.json") if not proglog else proglog
-        if not os.path.exists(downloaded_fname):
-            with open(downloaded_fname, "w") as f:
-                json.dump([fname], f)
-        else:
-            with open(downloaded_fname, "r") as f:
-                downloaded = list(json.load(f))
-            downloaded.append(fname)
-            with open(downloaded_fname, "w") as f:
-                json.dump(downloaded, f)
+        with open_progress(data_dir, proglog) as downloaded:
+            downloaded.add(fname)
 
     print(
         f"Successfully downloaded {mid}_{lang} (i.e. {read_video_dates(data_dir)[mid]}) at {datetime.datetime.now()}.")
 
 
 def download_single_meeting(
-    m3u8_links, mid, data_dir, target_lang="all", mthread=10, merge=True, log_progress=True
+    m3u8_links, mid, data_dir, target_lang="all", mthread=10, merge=True, log_progress=True,
+    engine="thread", variant="lowest", target_bitrate=None, adaptive=False, max_rate=None,
 ):
     """
     Download a single meeting (with all languages) for downloading demos.
@@ -168,8 +363,16 @@ def download_single_meeting(
     @param mthread: The number of thread used for downloading, default is 10.
     @param merge: Whether the downloaded .ts files will be merged into a full video, default is True.
     @param log_progress: Whether the download progress will be logged, default is True.
+    @param engine: The download engine, either "thread" or "async", default is thread.
+    @param variant: The rendition selection policy (see select_variants), default is lowest.
+    @param target_bitrate: The target bitrate in bits/s of the "closest" policy.
+    @param adaptive: Whether the number of in-flight segment requests (at most mthread) adapts to
+    the server's latency and errors, default is False.
+    @param max_rate: If specified, the bandwidth cap per host in bytes/s.
     """
     assert target_lang in ["can", "man", "eng", "all"]
+    controller = RateController(mthread, adaptive=adaptive, max_rate=max_rate) \
+        if adaptive or max_rate else None
 
     for lang, link in m3u8_links.items():
         if lang != target_lang and target_lang != "all":
@@ -182,49 +385,150 @@ def download_single_meeting(
             mthread=mthread,
             merge=merge,
             log_progress=log_progress,
+            engine=engine,
+            variant=variant,
+            target_bitrate=target_bitrate,
+            controller=controller,
         )
 
 
-def download_meetings(data_dir, session="all", mthread=16, merge=True, target_lang="all", proglog=None):
+def download_meetings(data_dir, session="all", mthread=16, merge=True, target_lang="all", proglog=None,
+                      engine="thread", max_videos=1, order="session", variant="lowest", target_bitrate=None,
+                      adaptive=False, max_rate=None, max_failures=3, shard=None, claims_dir=None,
+                      node_id=None):
     """
     Download meetings from the pre-fetched and preprocessed playlist.m3u8 link metadata.
     @param data_dir: The data directory to store and extract data/metadata.
     @param session: The target session for downloading, e.g. "1617", "1718". By default is all.
-    @param mthread: The number of thread used for downloading, default is 10.
+    @param mthread: The number of thread used for downloading, default is 10. If several videos are
+    downloaded at once, this is the global budget shared by all of them.
     @param merge: Whether the downloaded .ts files will be merged into a full video, default is True.
+    @param engine: The download engine, either "thread" or "async", default is thread.
+    @param max_videos: The number of videos downloaded at once, default is 1.
+    @param order: The order in which the videos are downloaded, "session" or "shortest" (first),
+    default is session.
+    @param variant: The rendition selection policy (see select_variants), default is lowest.
+    @param target_bitrate: The target bitrate in bits/s of the "closest" policy.
+    @param adaptive: Whether the number of in-flight segment requests (at most mthread) adapts to
+    the server's latency and errors, default is False.
+    @param max_rate: If specified, the bandwidth cap per host in bytes/s.
+    @param max_failures: Videos that failed this many times in a row (across runs) are quarantined,
+    i.e. skipped, default is 3.
+    @param shard: A tuple (i, n) to only download the videos of the i-th of n hash shards when
+    several nodes share the work. With claims_dir, the shard is only downloaded first.
+    @param claims_dir: If specified, the videos are claimed with lease files in this shared
+    directory (see sharding.LeaseClaims), so that nodes take over the videos of dead nodes.
+    @param node_id: The name of this node in sharded mode, default is the hostname. The progress of a
+    node is recorded in its own store (see sharding.node_proglog) and merged with
+    python sharding.py merge.
+    @return: A dictionary {fname: error} of the videos that failed in this run.
     """
     all_sessions = ["1617", "1718", "1819", "1920", "2021"]
     session = [session] if not isinstance(
         session, list) and session != "all" else session
     assert session == "all" or set(session).issubset(set(all_sessions))
 
-    downloaded_fname = os.path.join(
-        data_dir, "metadata", "global", "downloaded.json") if not proglog else proglog
-    if os.path.exists(downloaded_fname):
-        with open(downloaded_fname, "r") as f:
-            downloaded = json.load(f)
+    # In sharded mode, the videos downloaded by any node are skipped and this node records its
+    # progress in its own store
+    done_elsewhere = set()
+    claims = None
+    if shard is not None or claims_dir is not None:
+        node_id = node_id or sharding.default_node_id()
+        done_elsewhere = sharding.downloaded_by_main(data_dir, proglog)
+        done_elsewhere |= sharding.downloaded_by_nodes(data_dir)
+        proglog = sharding.node_proglog(data_dir, node_id)
+        if claims_dir is not None:
+            claims = sharding.LeaseClaims(claims_dir, node_id=node_id)
+
+    with open_progress(data_dir, proglog) as downloaded:
+        jobs = []
+        quarantined = []
+        m3u8_links = read_playlists(data_dir)
+        for session_id, mids in m3u8_links.items():
+            if session != "all" and session_id not in session:
+                continue
+            for mid, langs in mids.items():
+                for lang, link in langs.items():
+                    fname = "_".join([mid, lang]) + ".mp4"
+                    if fname in downloaded or target_lang != "all" and lang != target_lang:
+                        continue
+                    if fname in done_elsewhere or claims is None and not sharding.in_shard(fname, shard):
+                        continue
+                    if downloaded.failure_count(fname) >= max_failures:
+                        quarantined.append(fname)
+                        continue
+                    jobs.append(
+                        {"session": session_id, "mid": mid, "lang": lang, "link": link})
+
+    controller = RateController(mthread, adaptive=adaptive, max_rate=max_rate) \
+        if adaptive or max_rate else None
+
+    failures = {}
+    taken = []
+
+    def download_video(job, pool=None):
+        # A failed video is recorded and skipped, the rest of the run goes on
+        fname = "_".join([job["mid"], job["lang"]]) + ".mp4"
+        if claims is not None and not claims.claim(fname):
+            # Done or being downloaded by another node
+            taken.append(fname)
+            return
+        done = False
+        try:
+            download_from_playlist_m3u8(
+                link=job["link"],
+                mid=job["mid"],
+                data_dir=data_dir,
+                lang=job["lang"],
+                mthread=mthread if max_videos == 1 else max(1, mthread // max_videos),
+                merge=merge,
+                log_progress=True,
+                proglog=proglog,
+                engine=engine,
+                pool=pool,
+                variant=variant,
+                target_bitrate=target_bitrate,
+                controller=controller,
+            )
+            done = True
+        except Exception as e:
+            print(f"Failed to download {fname}: {e!r}")
+            failures[fname] = e
+            with open_progress(data_dir, proglog) as store:
+                store.add_failure(fname, repr(e))
+        finally:
+            if claims is not None:
+                claims.release(fname, done=done)
+
+    jobs = order_jobs(jobs, order=order)
+    if claims is not None and shard is not None:
+        # Start with the own shard, then help with the videos of the other (possibly dead) nodes
+        jobs.sort(key=lambda job: not sharding.in_shard(
+            "_".join([job["mid"], job["lang"]]) + ".mp4", shard))
+    if max_videos > 1:
+        # The connection pool is sized to the global budget
+        http_client.get_session(pool_size=mthread)
+        run_jobs(jobs, download_video, mthread=mthread, max_videos=max_videos)
     else:
-        downloaded = []
+        for job in jobs:
+            download_video(job)
 
-    m3u8_links = read_playlists(data_dir)
-    for session_id, mids in m3u8_links.items():
-        if session != "all" and session_id not in session:
-            continue
-        for mid, langs in mids.items():
-            for lang, link in langs.items():
-                fname = "_".join([mid, lang]) + ".mp4"
-                if fname in downloaded or target_lang != "all" and lang != target_lang:
-                    continue
-                download_from_playlist_m3u8(
-                    link=link,
-                    mid=mid,
-                    data_dir=data_dir,
-                    lang=lang,
-                    mthread=mthread,
-                    merge=merge,
-                    log_progress=True,
-                    proglog=proglog
-                )
+    if controller:
+        print(controller.summary())
+    if claims is not None:
+        claims.close()
+
+    # Summarize the failures of the run
+    print(f"Downloaded {len(jobs) - len(failures) - len(taken)}/{len(jobs)} videos.")
+    if taken:
+        print(f"Skipped {len(taken)} videos done or claimed by other nodes.")
+    if quarantined:
+        print(
+            f"Skipped {len(quarantined)} quarantined videos (failed {max_failures} times): {', '.join(quarantined)}")
+    for fname, e in failures.items():
+        print(f"FAILED {fname}: {e!r}")
+
+    return failures
 
 
 def main():
@@ -236,18 +540,44 @@ def main():
     parser.add_argument('--session', type=str, choices=session_choices, default="all",
                         help='Target session (e.g. "1617", "1718", "1819", "1920", "2021") to download, default is all')
     parser.add_argument('--proglog', type=Path, default=os.path.join(f"{DATA_DIR}", "metadata", "global", "downloaded.json"),
-                        help='Path to the json file for storing the progress.')
+                        help='Path to the progress store (.db), a legacy .json list is imported into a .db next to it.')
+    parser.add_argument('--engine', type=str, choices=["thread", "async"], default="thread",
+                        help='Download engine, "async" runs all segment requests on one event loop.')
+    parser.add_argument('--mthread', type=int, default=MTHREAD,
+                        help='Number of threads (or concurrent requests for the async engine).')
+    parser.add_argument('--max-videos', type=int, default=1,
+                        help='Number of videos downloaded at once, sharing the --mthread budget.')
+    parser.add_argument('--order', type=str, choices=ORDERS, default="session",
+                        help='Download order of the videos, "shortest" downloads the shortest ones first.')
+    parser.add_argument('--variant', type=str, choices=VARIANTS, default="lowest",
+                        help='Rendition to download from the master playlist, default is the lowest bandwidth.')
+    parser.add_argument('--target-bitrate', type=int, default=None,
+                        help='Target bitrate in bits/s of the "closest" variant policy.')
+    parser.add_argument('--adaptive', action="store_true",
+                        help='Adapt the number of in-flight segment requests (up to --mthread) to the server.')
+    parser.add_argument('--max-rate', type=float, default=None,
+                        help='Bandwidth cap per host in MB/s.')
+    parser.add_argument('--max-failures', type=int, default=3,
+                        help='Skip videos that failed this many times in a row, default is 3.')
+    parser.add_argument('--shard', type=sharding.parse_shard, default=None,
+                        help='Shard "i/n" of the videos downloaded by this node (by stable hash).')
+    parser.add_argument('--claims-dir', type=str, default=None,
+                        help='Shared directory of the lease files, nodes claim videos one by one and '
+                             'take over the videos of dead nodes.')
+    parser.add_argument('--node-id', type=str, default=None,
+                        help='Name of this node in sharded mode, default is the hostname.')
     args = parser.parse_args()
 
-    while True:
-        try:
-            download_meetings(data_dir=DATA_DIR, session=args.session,
-                              target_lang="can", mthread=MTHREAD, proglog=args.proglog)
-        except:
-            print("Connection timeout, will retry in 20s...")
-            time.sleep(20)
-        else:
-            break
+    failures = download_meetings(data_dir=DATA_DIR, session=args.session,
+                                 target_lang="can", mthread=args.mthread, proglog=args.proglog,
+                                 engine=args.engine, max_videos=args.max_videos, order=args.order,
+                                 variant=args.variant, target_bitrate=args.target_bitrate,
+                                 adaptive=args.adaptive,
+                                 max_rate=args.max_rate * 1024 * 1024 if args.max_rate else None,
+                                 max_failures=args.max_failures, shard=args.shard,
+                                 claims_dir=args.claims_dir, node_id=args.node_id)
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == "__main__":